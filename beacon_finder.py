@@ -1,214 +1,781 @@
-import argparse
-from collections import Counter
-from collections import OrderedDict
-
-def read_bro_file(filename):
-    ''' Reads in a file and puts each line into a list. Returns
-    the list.
-    '''
-    log_list = open(filename).read().splitlines()[1:]
-    return log_list
-        
-
-def sort_byte_count(data):
-    sorted_orig_bytes_dict = OrderedDict(sorted(data.items(), key=lambda i: i[1]['orig_bytes'], reverse=True))
-    sorted_resp_bytes_dict = OrderedDict(sorted(data.items(), key=lambda i: i[1]['resp_bytes'], reverse=True))
-    return sorted_orig_bytes_dict, sorted_resp_bytes_dict
-
-
-def count_interval(data):
-    ip_counter = Counter()
-    for i in data:
-        ip_counter.update(data[i])
-
-    return ip_counter
-
-
-def get_common_intersection(data_dict):
-    ''' Not implemented
-    '''
-    keys = []
-    for i in data_dict:
-        keys.append(data_dict[i])
-    print(keys[0])
-    common = set(data_dict[0])
-
-    for alist in data_dict.values():
-        common.intersection_update(set(alist))
-
-
-def get_unique_dict(data_dict):
-    ''' Takes the dictionary full of timing intervals and IP
-    addresses and builds a new dictionary with the same keys but
-    with only unique IP addresses. Returns the new dictionary with
-    unique IP addreses.
-    '''
-    print(" [+]  Creating a new dictionary with unique IP addresses.\n")
-    new_dict = {}
-    for i in data_dict:
-        new_dict[i] = list(set(data_dict[i]))
-    return new_dict
-
-
-def count_dest_ips(data, n):
-    ''' Counts the destination IP addresses and returns the n most
-    visited addresses
-    '''
-    print("\n [+]  Counting destination IP addresses.\n")
-    ip_counter = Counter()
-    for item in data:
-        ip = item[1]
-        ip_counter.update([ip])
-
-    return ip_counter.most_common(n) 
-
-
-def count_bytes(data):
-    ''' Maps the bytes to each IP and adds them up.
-    '''
-    print("\n [+]  Adding the transferred bytes for all hosts. \n")
-    new_dict = {}
-    for item in data:
-        try:
-            orig_bytes = int(item[0])
-            resp_bytes = int(item[1])
-            dest_ip = item[2]
-        except:
-            continue
-        if dest_ip not in new_dict:
-            new_dict[dest_ip] = {"orig_bytes": [orig_bytes], 
-                                 "resp_bytes": [resp_bytes]}
-        else: 
-            new_dict[dest_ip]['orig_bytes'].append(orig_bytes)
-            new_dict[dest_ip]['resp_bytes'].append(resp_bytes)
-
-    for item in new_dict:
-        new_dict[item]['orig_bytes'] = sum(new_dict[item]['orig_bytes'])
-        new_dict[item]['resp_bytes'] = sum(new_dict[item]['resp_bytes'])
-
-    return new_dict
-
-
-def get_interval_minutes(interval, data):
-    ''' Creates a dictionary with keys corresponding to the 
-    hour (1-24) and specified minute interval. The log timestamp
-    is read and the corresponding IP address is added to the 
-    appropriate key. Returns the dictionary consisting of
-    intervals and IP addresses
-    '''
-    time_intervals = {}
-    keys = []
-    for i in range(1,25):
-        for timeframe in range(0, 60, interval):
-            time_intervals[str(i).zfill(2) + '-' + str(timeframe)] = []
-            keys.append(str(i).zfill(2) + '-' + str(timeframe))
-
-    print("\n [+]  Creating a dictionary with {} keys.\n".format(len(keys)))
-
-    for item in data:
-        timestamp = item[0]
-        hour = int(timestamp[11:13])
-        minutes = int(timestamp[14:16])
-        
-        ip = item[1] 
-
-        for i in range(len(keys)):
-            try:
-                t1 = int(keys[i].split('-')[1])
-                t2 = int(keys[i + 1].split('-')[1]) 
-                if t1 < minutes < t2:
-                    time_intervals[keys[i]].append(ip)
-            except IndexError:
-                if t1 < minutes < 61:
-                    time_intervals[keys[i]].append(ip)
-
-    return time_intervals
-
-
-def main():
-    contents = read_bro_file(filename)
-    time_data = []
-    bytes_data = []
-    ip_list = []
-    suspects = []
-
-    for line in contents:
-        time_dest_data = []
-        host_bytes_data = []
-        timestamp = line.split(',')[0].strip('"')
-        orig_bytes = line.split(',')[-4].strip('"')
-        resp_bytes = line.split(',')[-3].strip('"')
-
-        dest_ip = line.split(',')[3].strip('"')
-        ip_list.append(dest_ip)
-        time_dest_data.extend((timestamp, dest_ip))
-        host_bytes_data.extend((orig_bytes, resp_bytes, dest_ip))
-        time_data.append(time_dest_data)
-        bytes_data.append((orig_bytes, resp_bytes, dest_ip))   
-
-    if args.most_common:
-        ip_counts = count_dest_ips(time_data, args.most_common)
-        for item in ip_counts:
-            print(item)
-
-    if args.most_bytes:
-        byte_count = count_bytes(bytes_data)
-        sorted_orig_byte_count, sorted_resp_byte_count = sort_byte_count(byte_count)
-        
-        print(" [+]  Hosts ordered by ORIG_IP_BYTES\n")
-        counter = 0
-        while counter < args.most_bytes:
-            for item in sorted_orig_byte_count:
-                print(item, sorted_orig_byte_count[item])
-                counter += 1
-                if counter == args.most_bytes:
-                    break
-
-        print("\n [+]  Hosts ordered by RESP_IP_BYTES\n")
-        counter = 0
-        while counter < args.most_bytes:
-            for item in sorted_resp_byte_count:
-                print(item, sorted_resp_byte_count[item])
-                counter += 1
-                if counter == args.most_bytes:
-                    break
-        
-    if args.analyze_intervals:
-        interval_ips_dict = get_interval_minutes(minutes_interval, time_data)
-        unique_dict = get_unique_dict(interval_ips_dict)
-        counted_intervals = count_interval(unique_dict)
-        print("IP ADDRESS  COUNT")
-        for item in counted_intervals.most_common(100):
-            addr = item[0]
-            occurence = item[1]
-            print(addr, occurence)
-
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
-    parser.add_argument("-mc", "--most_common", type=int, help="displays the n most visited destination ip addresses")
-    parser.add_argument("-mb", "--most_bytes", type=int, help="displays the n most ip addresses with most data transferred")
-    parser.add_argument("-m", "--minutes", type=int, choices=range(1,61), metavar="[1-60]", help="specify the minute interval to check between 1 and 60")
-    parser.add_argument("-f", "--filename", help="specify a bro log file.")
-    parser.add_argument("-ai", "--analyze_intervals", help="perform analysis on timing intervals", action="store_true")
-    args = parser.parse_args()
-
-    if not args.filename:
-        parser.print_help()
-        print("\n [-]  Please specify the filename to analyze.\n")
-        exit()
-
-    if args.minutes and not args.analyze_intervals:
-        parser.print_help()
-        print("\n [-]  The minutes argument needs to be used with the -ai switch.\n")
-        exit()
-
-    if args.analyze_intervals and not args.minutes:
-        parser.print_help()
-        print("\n [-]  The -ai argument also requires a time interval (-m 5).\n")
-        exit()
-
-    filename = args.filename
-    minutes_interval = args.minutes
-    main()
\ No newline at end of file
+import argparse
+import calendar
+import glob
+import gzip
+import heapq
+import json
+import os
+import tempfile
+import time
+from array import array
+from collections import deque
+from functools import lru_cache
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+
+try:
+    import numpy as np
+except ImportError as error:
+    missing_module = str(error).split(' ')[-1]
+    print('\nThis script requires several modules that you may not have.')
+    print('Missing module: {}'.format(missing_module))
+    print('Try running "pip install {}", or do an Internet search for installation instructions.'.format(missing_module.strip("'")))
+    exit()
+
+
+# Column positions in the CSV export of a bro/zeek conn.log
+TS_COL = 0
+SRC_IP_COL = 1
+DEST_IP_COL = 3
+ORIG_BYTES_COL = -4
+RESP_BYTES_COL = -3
+
+# Approximate number of bytes handed to a worker at a time
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Number of cached rows aggregated at a time
+SLICE_ROWS = 4 * 1024 * 1024
+
+# Upper bound on the length of the arrival series fed to the FFT
+MAX_FFT_BINS = 65536
+
+# Layout of the columnar cache written next to a log. Timestamps are
+# microseconds since the epoch, IP addresses are indexes into ips.txt and
+# byte counts are -1 where the log has no number for them.
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.bfcache'
+CACHE_COLUMNS = [
+    ('ts', 'int64'),
+    ('src', 'uint32'),
+    ('dst', 'uint32'),
+    ('orig_bytes', 'int64'),
+    ('resp_bytes', 'int64'),
+]
+
+
+def read_bro_file(filename, chunk_size=CHUNK_SIZE):
+    ''' Reads a log file in blocks of roughly chunk_size bytes, extending
+    each block to the end of its last line so no row is cut in half. The
+    header line is skipped. Logs ending in .gz are decompressed on the
+    fly. Yields the blocks one at a time so only a few of them are ever
+    held in memory.
+    '''
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rb') as fh:
+        fh.readline()
+        while True:
+            block = fh.read(chunk_size)
+            if not block:
+                break
+            yield block + fh.readline()
+
+
+@lru_cache(maxsize=4096)
+def epoch_seconds(prefix):
+    ''' Converts a 'YYYY-MM-DDTHH:MM:SS' string, taken as UTC, to whole
+    seconds since the epoch. Cached because consecutive log rows mostly
+    share the same second.
+    '''
+    return calendar.timegm(time.strptime(prefix, '%Y-%m-%dT%H:%M:%S'))
+
+
+def parse_epoch(timestamp):
+    ''' Returns the number of seconds since the epoch for either a native
+    zeek timestamp (1526282123.123456) or the ISO 8601 form written by the
+    CSV export (2018-05-14T07:15:23.123456Z). Returns None if the timestamp
+    cannot be parsed.
+    '''
+    try:
+        return float(timestamp)
+    except ValueError:
+        pass
+    try:
+        seconds = epoch_seconds(timestamp[:19])
+    except ValueError:
+        return None
+    end = 20
+    while end < len(timestamp) and timestamp[end].isdigit():
+        end += 1
+    if end > 20 and timestamp[19] == '.':
+        seconds += float(timestamp[19:end])
+    return seconds
+
+
+def parse_block(block):
+    ''' Runs in a worker process. Splits each line of a block once into
+    typed columns. Returns the list of IP addresses seen in the block and
+    a dictionary of NumPy columns laid out as in CACHE_COLUMNS, where the
+    src and dst columns index into that list.
+    '''
+    ips = {}
+    columns = {name: array('q' if dtype == 'int64' else 'I') for name, dtype in CACHE_COLUMNS}
+    for line in block.decode('utf-8', errors='replace').splitlines():
+        fields = line.split(',')
+        if len(fields) <= DEST_IP_COL:
+            continue
+        epoch = parse_epoch(fields[TS_COL].strip('"'))
+        if epoch is None:
+            continue
+        try:
+            orig_bytes = int(fields[ORIG_BYTES_COL].strip('"'))
+            resp_bytes = int(fields[RESP_BYTES_COL].strip('"'))
+        except ValueError:
+            orig_bytes = resp_bytes = -1
+        columns['ts'].append(int(round(epoch * 1000000)))
+        columns['src'].append(ips.setdefault(fields[SRC_IP_COL].strip('"'), len(ips)))
+        columns['dst'].append(ips.setdefault(fields[DEST_IP_COL].strip('"'), len(ips)))
+        columns['orig_bytes'].append(orig_bytes)
+        columns['resp_bytes'].append(resp_bytes)
+    return list(ips), {name: np.asarray(columns[name], dtype=dtype) for name, dtype in CACHE_COLUMNS}
+
+
+def file_signature(filename):
+    ''' Returns the size and modification time used to tell whether a
+    cache still matches its log.
+    '''
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def read_meta(cache_dir):
+    ''' Returns the contents of a cache's meta.json, or None if the cache
+    is missing, unfinished or from another version.
+    '''
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    return meta
+
+
+def write_meta(cache_dir, meta):
+    ''' Replaces a cache's meta.json in one step, so a reader never sees a
+    half written file.
+    '''
+    with open(os.path.join(cache_dir, 'meta.json.tmp'), 'w') as fh:
+        json.dump(meta, fh)
+    os.replace(os.path.join(cache_dir, 'meta.json.tmp'), os.path.join(cache_dir, 'meta.json'))
+
+
+def write_ips(cache_dir, ip_ids):
+    ''' Writes the IP address table of a cache, one address per line in
+    index order.
+    '''
+    with open(os.path.join(cache_dir, 'ips.txt'), 'w') as fh:
+        for ip in ip_ids:
+            fh.write(ip + '\n')
+
+
+def remap_ips(ip_ids, ips, columns):
+    ''' Renumbers the src and dst columns of a parsed block from the
+    block's own IP address list to the shared ip_ids table, adding any
+    addresses it does not have yet.
+    '''
+    mapping = np.array([ip_ids.setdefault(ip, len(ip_ids)) for ip in ips], dtype=np.uint32)
+    columns['src'] = mapping[columns['src']]
+    columns['dst'] = mapping[columns['dst']]
+    return columns
+
+
+def load_cache(cache_dir, signature=None):
+    ''' Memory maps the columns of a cache. Returns a tuple of the IP
+    address list and a dictionary of columns, or None if the cache is
+    missing, unfinished, from another version or, when a signature is
+    given, was built from a different version of the log.
+    '''
+    meta = read_meta(cache_dir)
+    if not meta:
+        return None
+    if signature and meta.get('source') != signature:
+        return None
+
+    with open(os.path.join(cache_dir, 'ips.txt')) as fh:
+        ips = fh.read().splitlines()
+    columns = {}
+    for name, dtype in CACHE_COLUMNS:
+        if meta['rows']:
+            columns[name] = np.memmap(os.path.join(cache_dir, name + '.bin'), dtype=dtype,
+                                      mode='r', shape=(meta['rows'],))
+        else:
+            columns[name] = np.zeros(0, dtype=dtype)
+    return ips, columns
+
+
+def build_cache(filename, cache_dir, workers):
+    ''' Streams the log through a pool of worker processes that parse it
+    into columns, and appends the columns to the cache as they come back.
+    Only a couple of blocks per worker are in flight at once, so memory
+    use does not grow with the size of the file. The IP addresses of each
+    block are renumbered to one table shared by the whole log. meta.json
+    is written last, so an interrupted build is never mistaken for a
+    finished cache.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    signature = file_signature(filename)
+    ip_ids = {}
+    rows = 0
+    outfiles = {name: open(os.path.join(cache_dir, name + '.bin'), 'wb') for name, dtype in CACHE_COLUMNS}
+
+    def write_block(result):
+        nonlocal rows
+        columns = remap_ips(ip_ids, *result)
+        for name, dtype in CACHE_COLUMNS:
+            columns[name].tofile(outfiles[name])
+        rows += len(columns['ts'])
+
+    pending = deque()
+    try:
+        with Pool(workers) as pool:
+            for block in read_bro_file(filename):
+                pending.append(pool.apply_async(parse_block, (block,)))
+                if len(pending) >= workers * 2:
+                    write_block(pending.popleft().get())
+            while pending:
+                write_block(pending.popleft().get())
+    finally:
+        for outfile in outfiles.values():
+            outfile.close()
+
+    write_ips(cache_dir, ip_ids)
+    write_meta(cache_dir, {'version': CACHE_VERSION, 'source': signature, 'rows': rows})
+
+
+def open_log(filename, cache_dir, workers, reuse=True):
+    ''' Returns the IP address list and columns of a log, reusing the cache
+    in cache_dir when it still matches the log and building it otherwise.
+    '''
+    if reuse:
+        cached = load_cache(cache_dir, file_signature(filename))
+        if cached:
+            print(" [+]  Using the cached columns in {}.\n".format(cache_dir))
+            return cached
+    print(" [+]  Parsing {} with {} workers.\n".format(filename, workers))
+    build_cache(filename, cache_dir, workers)
+    return load_cache(cache_dir)
+
+
+def find_logs(path):
+    ''' Returns the sorted list of conn logs in a directory, that is the
+    files whose names start with conn, or of the files matching a glob
+    pattern. A zeek log directory also holds dns, http, ssl and other
+    logs, which must not be read as connections. Rotated zeek logs are
+    named after the time they were rotated, so sorting puts them in order.
+    '''
+    if os.path.isdir(path):
+        path = os.path.join(path, 'conn*')
+    return sorted(filename for filename in glob.glob(path) if os.path.isfile(filename))
+
+
+def parse_file(filename):
+    ''' Runs in a worker process. Parses a whole log into columns and
+    returns its IP address list and columns the same way parse_block
+    does for a single block.
+    '''
+    ip_ids = {}
+    parts = [remap_ips(ip_ids, *parse_block(block)) for block in read_bro_file(filename)]
+    columns = {}
+    for name, dtype in CACHE_COLUMNS:
+        columns[name] = np.concatenate([part[name] for part in parts]) if parts else np.zeros(0, dtype=dtype)
+    return list(ip_ids), columns
+
+
+def load_state(state_dir):
+    ''' Returns the meta data, IP address list and memory mapped columns
+    of a rolling window state, or an empty state if there is none yet.
+    '''
+    meta = read_meta(state_dir)
+    if not meta or 'segments' not in meta:
+        meta = {'version': CACHE_VERSION, 'rows': 0, 'offset': 0, 'segments': []}
+        ips = []
+    else:
+        with open(os.path.join(state_dir, 'ips.txt')) as fh:
+            ips = fh.read().splitlines()
+    return meta, ips
+
+
+def state_columns(state_dir, meta):
+    ''' Memory maps the rows of a rolling window state that are still in
+    the window.
+    '''
+    columns = {}
+    for name, dtype in CACHE_COLUMNS:
+        if meta['rows'] > meta['offset']:
+            columns[name] = np.memmap(os.path.join(state_dir, name + '.bin'), dtype=dtype, mode='r',
+                                      offset=meta['offset'] * np.dtype(dtype).itemsize,
+                                      shape=(meta['rows'] - meta['offset'],))
+        else:
+            columns[name] = np.zeros(0, dtype=dtype)
+    return columns
+
+
+def compact_state(state_dir, meta, segments):
+    ''' Rewrites the column files of a state so they only hold the given
+    segments, one column and one segment at a time.
+    '''
+    for name, dtype in CACHE_COLUMNS:
+        column_file = os.path.join(state_dir, name + '.bin')
+        column = np.memmap(column_file, dtype=dtype, mode='r', shape=(meta['rows'],)) if meta['rows'] else None
+        with open(column_file + '.tmp', 'wb') as fh:
+            for segment in segments:
+                np.asarray(column[segment['start']:segment['start'] + segment['rows']]).tofile(fh)
+        del column
+        os.replace(column_file + '.tmp', column_file)
+    start = 0
+    for segment in segments:
+        segment['start'] = start
+        start += segment['rows']
+    meta.update({'rows': start, 'offset': 0, 'segments': segments})
+
+
+def fold_logs(filenames, state_dir, workers, window_hours=None):
+    ''' Folds rotated logs into a rolling window state kept in state_dir.
+    The state uses the cache layout, plus a list of segments recording
+    which rows came from which log. Logs already in the state are
+    skipped, so folding in a new hour only parses that hour. New logs are
+    parsed in parallel, one log per worker, and appended to the columns.
+    With window_hours, segments that ended more than window_hours before
+    the newest connection are dropped, by moving the offset of the first
+    row still in the window where possible and by compacting the column
+    files otherwise. Dropped and empty logs are kept in a retired map
+    of path to signature, so they are not parsed again while they stay
+    unchanged. Returns the IP address list and the columns in the window.
+    '''
+    os.makedirs(state_dir, exist_ok=True)
+    meta, ips = load_state(state_dir)
+    ip_ids = {ip: i for i, ip in enumerate(ips)}
+
+    # A log that changed since it was folded in or retired is dropped and
+    # parsed again. Retired logs no longer in filenames are forgotten.
+    known = {segment['path']: segment for segment in meta['segments']}
+    paths = [os.path.abspath(filename) for filename in filenames]
+    retired = {path: signature for path, signature in meta.get('retired', {}).items() if path in paths}
+    stored = list(meta['segments'])
+    new_files = []
+    for filename, path in zip(filenames, paths):
+        signature = file_signature(filename)
+        if path in known:
+            if known[path]['source'] == signature:
+                continue
+            meta['segments'].remove(known[path])
+        elif retired.get(path) == signature:
+            continue
+        retired.pop(path, None)
+        new_files.append(filename)
+
+    # Rows past meta['rows'] were left by an interrupted fold
+    for name, dtype in CACHE_COLUMNS:
+        column_file = os.path.join(state_dir, name + '.bin')
+        with open(column_file, 'ab'):
+            pass
+        os.truncate(column_file, meta['rows'] * np.dtype(dtype).itemsize)
+
+    if new_files:
+        print(" [+]  Parsing {} new logs with {} workers.\n".format(len(new_files), workers))
+    with Pool(workers) as pool:
+        for filename, result in zip(new_files, pool.imap(parse_file, new_files)):
+            columns = remap_ips(ip_ids, *result)
+            for name, dtype in CACHE_COLUMNS:
+                with open(os.path.join(state_dir, name + '.bin'), 'ab') as fh:
+                    columns[name].tofile(fh)
+            rows = len(columns['ts'])
+            segment = {
+                'path': os.path.abspath(filename),
+                'source': file_signature(filename),
+                'start': meta['rows'],
+                'rows': rows,
+                'first_ts': int(columns['ts'].min()) if rows else None,
+                'last_ts': int(columns['ts'].max()) if rows else None,
+            }
+            meta['rows'] += rows
+            stored.append(segment)
+            meta['segments'].append(segment)
+
+    live = [segment for segment in meta['segments'] if segment['rows']]
+    if window_hours and live:
+        cutoff = max(segment['last_ts'] for segment in live) - int(window_hours * 3600 * 1000000)
+        live = [segment for segment in live if segment['last_ts'] >= cutoff]
+    for segment in meta['segments']:
+        if segment not in live:
+            retired[segment['path']] = segment['source']
+    meta['retired'] = retired
+
+    # Dropped rows in front of the window are skipped by moving the offset.
+    # Dropped rows between live ones, or an offset past half of the files,
+    # call for a rewrite.
+    first_live = live[0]['start'] if live else meta['rows']
+    dropped = [segment for segment in stored if segment not in live and segment['rows']]
+    if any(segment['start'] > first_live for segment in dropped) or first_live > meta['rows'] - first_live:
+        compact_state(state_dir, meta, live)
+    else:
+        meta.update({'offset': first_live, 'segments': live})
+
+    write_ips(state_dir, ip_ids)
+    write_meta(state_dir, meta)
+    return list(ip_ids), state_columns(state_dir, meta)
+
+
+def iter_slices(*columns):
+    ''' Yields the given columns SLICE_ROWS rows at a time, so aggregates
+    over memory mapped columns only page in one slice at a time.
+    '''
+    for start in range(0, len(columns[0]), SLICE_ROWS):
+        yield tuple(np.asarray(column[start:start + SLICE_ROWS]) for column in columns)
+
+
+def count_interval(keys, bucket_count, dest_count):
+    ''' Counts the number of time buckets each destination was seen in,
+    from the distinct dest * bucket_count + bucket keys of its rows.
+    '''
+    return np.bincount(keys // bucket_count, minlength=dest_count)
+
+
+def get_common_intersection(data_dict):
+    ''' Not implemented
+    '''
+    keys = []
+    for i in data_dict:
+        keys.append(data_dict[i])
+    print(keys[0])
+    common = set(data_dict[0])
+
+    for alist in data_dict.values():
+        common.intersection_update(set(alist))
+
+
+def count_dest_ips(dst, ip_count):
+    ''' Counts the connections to each destination IP address in a slice.
+    Returns an array indexed by IP address that can be added to the counts
+    of other slices.
+    '''
+    return np.bincount(dst, minlength=ip_count)
+
+
+def count_bytes(keys, orig_bytes, resp_bytes, key_count):
+    ''' Maps the bytes of a slice to each key (a destination IP address, or
+    a source/destination pair) and adds them up, along with the number of
+    connections and the sum of the squared orig_bytes used to measure how
+    consistent the transfer sizes are. Rows without byte counts are
+    skipped. Returns a dictionary of arrays indexed by key that can be
+    added to the counts of other slices with merge_byte_counts.
+    '''
+    has_bytes = orig_bytes >= 0
+    keys = keys[has_bytes]
+    orig_bytes = orig_bytes[has_bytes].astype(float)
+    resp_bytes = resp_bytes[has_bytes].astype(float)
+    return {
+        'orig_bytes': np.bincount(keys, orig_bytes, minlength=key_count),
+        'resp_bytes': np.bincount(keys, resp_bytes, minlength=key_count),
+        'connections': np.bincount(keys, minlength=key_count),
+        'orig_bytes_sq': np.bincount(keys, orig_bytes ** 2, minlength=key_count),
+    }
+
+
+def first_rows(key_slices, key_count):
+    ''' Returns the position of the first row holding each key across a
+    series of slices of keys, or the number of rows for keys never seen.
+    '''
+    first = None
+    offset = 0
+    for keys in key_slices:
+        unique, index = np.unique(keys, return_index=True)
+        if first is None:
+            first = np.full(key_count, np.iinfo(np.int64).max, dtype=np.int64)
+        first[unique] = np.minimum(first[unique], index + offset)
+        offset += len(keys)
+    if first is None:
+        return np.zeros(key_count, dtype=np.int64)
+    return np.minimum(first, offset)
+
+
+def rank_keys(values, first):
+    ''' Returns the keys ordered by value, highest first, with ties in the
+    order the keys were first seen, as Counter.most_common and a stable
+    reverse sort order them.
+    '''
+    return np.lexsort((first, -values))
+
+
+def merge_byte_counts(total, part):
+    ''' Adds the byte counts of one slice into the running totals.
+    '''
+    if not total:
+        return part
+    for field, values in part.items():
+        total[field] += values
+    return total
+
+
+def interval_bucket_count(interval):
+    ''' Returns the number of time buckets of interval minutes in a day.
+    '''
+    return 24 * len(range(0, 60, interval))
+
+
+def get_interval_minutes(interval, ts, dest_index):
+    ''' Assigns each row to a time bucket made up of the hour and the
+    minute interval it falls in (hour * buckets_per_hour + minute //
+    interval), so every row lands in exactly one bucket. Returns the
+    sorted distinct dest * bucket_count + bucket keys of the rows
+    (dest_index numbers the destinations from 0), so memory grows with
+    the rows rather than with destinations times buckets.
+    '''
+    buckets_per_hour = len(range(0, 60, interval))
+    minutes = ts // 60000000
+    buckets = (minutes // 60 % 24) * buckets_per_hour + (minutes % 60) // interval
+    return np.unique(dest_index * interval_bucket_count(interval) + buckets)
+
+
+def group_medians(groups, values):
+    ''' Returns the unique values of groups and the median of values
+    within each of them.
+    '''
+    order = np.lexsort((values, groups))
+    groups = groups[order]
+    values = values[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    sizes = np.diff(np.r_[starts, len(values)])
+    medians = (values[starts + (sizes - 1) // 2] + values[starts + sizes // 2]) / 2
+    return groups[starts], medians
+
+
+def periodogram_peak(arrivals, median_interval):
+    ''' Bins the sorted arrival times of a pair into a connection count
+    series with about four bins per median interval and returns the share
+    of the series' power held by the beacon frequency and its harmonics.
+    Arrivals are centred in their bins and the series is cut to a whole
+    number of median intervals, so a regular pulse train does not leak
+    power between frequencies. The fundamental is the strongest
+    frequency within 10% of the one the median interval gives, and each
+    harmonic takes the bins next to it as well, so drift still counts. A
+    regular beacon puts nearly all its power there and scores close to
+    1, jitter lowers the score, and random arrivals spread their power
+    over the whole spectrum and score close to 0.
+    '''
+    span = arrivals[-1] - arrivals[0]
+    if span <= 0 or median_interval <= 0:
+        return 0.0
+    bin_width = max(median_interval / 4, span / MAX_FFT_BINS)
+    origin = arrivals[0] - bin_width / 2
+    series = np.bincount(((arrivals - origin) / bin_width).astype(np.int64)).astype(float)
+    period_bins = median_interval / bin_width
+    periods = int(len(series) / period_bins)
+    if periods >= 2:
+        series = series[:int(round(periods * period_bins))]
+    power = np.abs(np.fft.rfft(series - series.mean())) ** 2
+    power[0] = 0
+    total = power.sum()
+    expected = len(series) / period_bins
+    low, high = max(int(expected * 0.9), 1), int(np.ceil(expected * 1.1)) + 1
+    if total <= 0 or low >= len(power):
+        return 0.0
+    fundamental = low + int(np.argmax(power[low:high]))
+    harmonics = np.arange(fundamental, len(power), fundamental)
+    near = np.unique(np.clip(harmonics[:, None] + np.arange(-1, 2), 1, len(power) - 1))
+    return float(power[near].sum() / total)
+
+
+def size_consistency(counts):
+    ''' Scores how alike the orig_bytes of each key's connections are, from
+    1 (every connection sends the same amount) down to 0, using the
+    totals kept by count_bytes.
+    '''
+    connections = np.maximum(counts['connections'], 1)
+    means = counts['orig_bytes'] / connections
+    stds = np.sqrt(np.maximum(counts['orig_bytes_sq'] / connections - means ** 2, 0))
+    scores = np.clip(1 - np.divide(stds, means, out=np.ones(len(means)), where=means > 0), 0, 1)
+    scores[(means <= 0) & (stds == 0)] = 1.0
+    scores[counts['connections'] == 0] = 0.0
+    return scores
+
+
+def score_periodicity(pair_codes, timestamps, pair_bytes, min_connections, top_n):
+    ''' Scores how regularly each (source, destination) pair connects.
+    The arrivals of each pair are sorted and differenced, and the
+    inter-arrival times are scored on their median absolute deviation
+    relative to the median, their coefficient of variation and the
+    strength of the periodogram peak. The consistency of the transfer
+    sizes is used as a fourth signal. Pairs with fewer than
+    min_connections connections are ignored. Only the top_n best scores
+    are kept, on a heap. Returns them best first as (score, pair code,
+    connections, median interval, MAD, CV, FFT peak, size score) tuples.
+    '''
+    order = np.lexsort((timestamps, pair_codes))
+    pair_codes = pair_codes[order]
+    timestamps = timestamps[order] / 1000000
+    connections = np.bincount(pair_codes)
+    starts = np.r_[0, np.cumsum(connections)[:-1]]
+    size_scores = size_consistency(pair_bytes)
+
+    same_pair = pair_codes[1:] == pair_codes[:-1]
+    deltas = np.diff(timestamps)[same_pair]
+    delta_codes = pair_codes[1:][same_pair]
+    eligible = (connections >= max(min_connections, 3))[delta_codes]
+    deltas = deltas[eligible]
+    delta_codes = delta_codes[eligible]
+    if not len(deltas):
+        return []
+
+    codes, medians = group_medians(delta_codes, deltas)
+    index = np.searchsorted(codes, delta_codes)
+    mads = group_medians(delta_codes, np.abs(deltas - medians[index]))[1]
+    counts = np.bincount(index)
+    means = np.bincount(index, deltas) / counts
+    stds = np.sqrt(np.maximum(np.bincount(index, deltas ** 2) / counts - means ** 2, 0))
+    cvs = np.divide(stds, means, out=np.full(len(means), np.inf), where=means > 0)
+    mad_scores = np.clip(1 - np.divide(mads, medians, out=np.full(len(mads), np.inf), where=medians > 0), 0, 1)
+    cv_scores = np.clip(1 - cvs, 0, 1)
+
+    heap = []
+    for i, code in enumerate(codes):
+        size_score = float(size_scores[code])
+        # The FFT peak is at most 1, so skip it when even a perfect peak
+        # would not get the pair onto the heap.
+        if len(heap) == top_n and (mad_scores[i] + cv_scores[i] + size_score + 1) / 4 <= heap[0][0]:
+            continue
+        arrivals = timestamps[starts[code]:starts[code] + connections[code]]
+        peak = periodogram_peak(arrivals, medians[i])
+        score = (mad_scores[i] + cv_scores[i] + size_score + peak) / 4
+        item = (float(score), int(code), int(connections[code]), float(medians[i]),
+                float(mads[i]), float(cvs[i]), peak, size_score)
+        if len(heap) < top_n:
+            heapq.heappush(heap, item)
+        elif score > heap[0][0]:
+            heapq.heapreplace(heap, item)
+
+    return sorted(heap, reverse=True)
+
+
+def analyze_columns(ips, columns):
+    ''' Runs the requested analyses over the columns of a log and prints
+    the results.
+    '''
+    ip_count = len(ips)
+
+    dest_counts = np.zeros(ip_count, dtype=np.int64)
+    for dst, in iter_slices(columns['dst']):
+        dest_counts += count_dest_ips(dst, ip_count)
+
+    if args.most_common:
+        print("\n [+]  Counting destination IP addresses.\n")
+        first = first_rows((dst for dst, in iter_slices(columns['dst'])), ip_count)
+        for ip in rank_keys(dest_counts, first)[:args.most_common]:
+            print((ips[ip], int(dest_counts[ip])))
+
+    if args.most_bytes:
+        print("\n [+]  Adding the transferred bytes for all hosts. \n")
+        byte_count = {}
+        for dst, orig_bytes, resp_bytes in iter_slices(columns['dst'], columns['orig_bytes'], columns['resp_bytes']):
+            byte_count = merge_byte_counts(byte_count, count_bytes(dst, orig_bytes, resp_bytes, ip_count))
+
+        seen = np.flatnonzero(byte_count['connections'])
+        first = first_rows((dst[orig_bytes >= 0] for dst, orig_bytes in iter_slices(columns['dst'], columns['orig_bytes'])), ip_count)
+        for field, title in (('orig_bytes', 'ORIG_IP_BYTES'), ('resp_bytes', 'RESP_IP_BYTES')):
+            print(" [+]  Hosts ordered by {}\n".format(title))
+            for ip in seen[rank_keys(byte_count[field][seen], first[seen])][:args.most_bytes]:
+                print(ips[ip], {'orig_bytes': int(byte_count['orig_bytes'][ip]),
+                                'resp_bytes': int(byte_count['resp_bytes'][ip])})
+            print()
+
+    if args.analyze_intervals:
+        # Only destinations are numbered in the bucket keys. The distinct
+        # keys of each slice are merged once they outgrow the merged ones,
+        # so each key is sorted a bounded number of times
+        dests = np.flatnonzero(dest_counts)
+        dest_index = np.zeros(ip_count, dtype=np.int64)
+        dest_index[dests] = np.arange(len(dests))
+        bucket_count = interval_bucket_count(minutes_interval)
+        seen, pending = np.zeros(0, dtype=np.int64), []
+        for ts, dst in iter_slices(columns['ts'], columns['dst']):
+            pending.append(get_interval_minutes(minutes_interval, ts, dest_index[dst]))
+            if sum(map(len, pending)) > max(len(seen), SLICE_ROWS):
+                seen, pending = np.unique(np.concatenate([seen] + pending)), []
+        seen = np.unique(np.concatenate([seen] + pending))
+        print("IP ADDRESS  COUNT")
+        if len(seen):
+            counted_intervals = count_interval(seen, bucket_count, len(dests))
+            first = first_rows((dst for dst, in iter_slices(columns['dst'])), ip_count)
+            for i in rank_keys(counted_intervals, first[dests])[:100]:
+                print(ips[dests[i]], int(counted_intervals[i]))
+
+    if args.periodicity:
+        print("\n [+]  Scoring the regularity of connections between hosts.\n")
+        pair_keys, pair_codes = np.unique(columns['src'].astype(np.int64) * ip_count + columns['dst'],
+                                          return_inverse=True)
+        pair_bytes = {}
+        for codes, orig_bytes, resp_bytes in iter_slices(pair_codes, columns['orig_bytes'], columns['resp_bytes']):
+            pair_bytes = merge_byte_counts(pair_bytes, count_bytes(codes, orig_bytes, resp_bytes, len(pair_keys)))
+        scores = score_periodicity(pair_codes, np.asarray(columns['ts']), pair_bytes,
+                                   args.min_connections, args.periodicity)
+        print("SCORE  SOURCE  DESTINATION  CONNECTIONS  MEDIAN_INTERVAL  MAD  CV  FFT_PEAK  SIZE")
+        for score, code, connections, median, mad, cv, peak, size_score in scores:
+            src_ip, dest_ip = divmod(int(pair_keys[code]), ip_count)
+            print("{:.3f} {} {} {} {:.1f} {:.2f} {:.3f} {:.3f} {:.3f}".format(
+                score, ips[src_ip], ips[dest_ip], connections, median, mad, cv, peak, size_score))
+
+
+def main():
+    if args.directory:
+        filenames = find_logs(args.directory)
+        if not filenames:
+            print("\n [-]  No logs found in {}.\n".format(args.directory))
+            exit()
+        if args.state:
+            analyze_columns(*fold_logs(filenames, args.state, args.workers, args.window))
+        else:
+            with tempfile.TemporaryDirectory(prefix='beacon_finder_') as state_dir:
+                analyze_columns(*fold_logs(filenames, state_dir, args.workers, args.window))
+    elif args.no_cache:
+        with tempfile.TemporaryDirectory(prefix='beacon_finder_') as cache_dir:
+            analyze_columns(*open_log(filename, cache_dir, args.workers, reuse=False))
+    else:
+        analyze_columns(*open_log(filename, filename + CACHE_SUFFIX, args.workers))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    parser.add_argument("-mc", "--most_common", type=int, help="displays the n most visited destination ip addresses")
+    parser.add_argument("-mb", "--most_bytes", type=int, help="displays the n most ip addresses with most data transferred")
+    parser.add_argument("-m", "--minutes", type=int, choices=range(1,61), metavar="[1-60]", help="specify the minute interval to check between 1 and 60")
+    parser.add_argument("-f", "--filename", help="specify a bro log file.")
+    parser.add_argument("-d", "--directory", help="specify a directory of rotated bro conn logs (the files named conn*), or a glob pattern (quoted) of the logs to read, optionally gzipped.")
+    parser.add_argument("-s", "--state", help="specify a directory that keeps the parsed logs of -d between runs, so only new logs are parsed")
+    parser.add_argument("-rw", "--window", type=float, help="with -d, only analyze logs within this many hours of the newest connection")
+    parser.add_argument("-ai", "--analyze_intervals", help="perform analysis on timing intervals", action="store_true")
+    parser.add_argument("-p", "--periodicity", type=int, help="displays the n source/destination pairs that connect at the most regular intervals")
+    parser.add_argument("-mn", "--min_connections", type=int, default=10, help="specify the fewest connections a pair needs to be scored with -p (default=10)")
+    parser.add_argument("-w", "--workers", type=int, default=cpu_count(), help="specify the number of worker processes (default=number of cores)")
+    parser.add_argument("-nc", "--no_cache", help="do not write or reuse the parsed column cache kept next to the log", action="store_true")
+    args = parser.parse_args()
+
+    if not args.filename and not args.directory:
+        parser.print_help()
+        print("\n [-]  Please specify the filename (-f) or directory of logs (-d) to analyze.\n")
+        exit()
+
+    if args.filename and args.directory:
+        parser.print_help()
+        print("\n [-]  Please specify either -f or -d, not both.\n")
+        exit()
+
+    if (args.state or args.window) and not args.directory:
+        parser.print_help()
+        print("\n [-]  The -s and -rw arguments need to be used with -d.\n")
+        exit()
+
+    if args.minutes and not args.analyze_intervals:
+        parser.print_help()
+        print("\n [-]  The minutes argument needs to be used with the -ai switch.\n")
+        exit()
+
+    if args.analyze_intervals and not args.minutes:
+        parser.print_help()
+        print("\n [-]  The -ai argument also requires a time interval (-m 5).\n")
+        exit()
+
+    filename = args.filename
+    minutes_interval = args.minutes
+    main()
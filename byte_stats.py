@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+__author__ = 'Jake Miller (@LaconicWolf)'
+__date__ = '20180514'
+__version__ = '0.01'
+__description__ = """Byte distribution statistics shared by check_byte_distribution.py
+and plot_bytes.py"""
+
+
+import math
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+
+# Number of bytes counted at a time. np.bincount widens its input to
+# int64, so each chunk costs eight times its size in scratch memory
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Limits on the bytes and on the per block histograms held at a time while
+# computing sliding window entropy
+WINDOW_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_WINDOW_BLOCKS = 32768
+
+
+def as_byte_array(data):
+    """Returns a uint8 view of a byte-string, bytearray, memoryview or
+    mmap without copying it.
+    """
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def byte_histogram(data):
+    """Returns an array of 256 counts holding the number of times each
+    byte value occurs in the data. The data is counted CHUNK_SIZE bytes at
+    a time to bound the scratch memory.
+    """
+    values = as_byte_array(data)
+    if len(values) <= CHUNK_SIZE:
+        return np.bincount(values, minlength=256)
+    histogram = np.zeros(256, dtype=np.int64)
+    for offset in range(0, len(values), CHUNK_SIZE):
+        histogram += np.bincount(values[offset:offset + CHUNK_SIZE], minlength=256)
+    return histogram
+
+
+def missing_bytes(histogram):
+    """Returns the byte values that do not occur in the data.
+    """
+    return np.flatnonzero(histogram == 0)
+
+
+def shannon_entropy(histogram):
+    """Returns the Shannon entropy of the data in bits per byte, from 0
+    (a single repeated value) to 8 (every value equally likely).
+    """
+    total = histogram.sum()
+    if not total:
+        return 0.0
+    probabilities = histogram[histogram > 0] / total
+    return float(-(probabilities * np.log2(probabilities)).sum())
+
+
+def chi_square(histogram):
+    """Returns the chi-square statistic of the byte counts against a
+    uniform distribution. Random or encrypted data stays close to the 255
+    degrees of freedom, while text and structured data score far higher.
+    """
+    total = histogram.sum()
+    if not total:
+        return 0.0
+    expected = total / 256
+    return float(((histogram - expected) ** 2 / expected).sum())
+
+
+def line_stats(items):
+    """Computes the length, Shannon entropy and number of missing byte
+    values of every byte-string in a list at once. The items are joined
+    and every (item, byte value) pair is counted in one sort, so short
+    items do not pay for 256 empty counts each. Returns three arrays
+    indexed like the list.
+    """
+    lengths = np.fromiter(map(len, items), dtype=np.int64, count=len(items))
+    values = as_byte_array(b''.join(items))
+    keys = np.repeat(np.arange(len(items), dtype=np.int64) * 256, lengths) + values
+    keys.sort()
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+    counts = np.diff(np.r_[starts, len(keys)])
+    rows = keys[starts] // 256
+    weighted = np.bincount(rows, counts * np.log2(counts), minlength=len(items))
+    sizes = np.maximum(lengths, 1)
+    entropies = np.log2(sizes) - weighted / sizes
+    missing = 256 - np.bincount(rows, minlength=len(items))
+    return lengths, entropies, missing
+
+
+def byte_stats(data):
+    """Computes the histogram of the data in one pass and returns a
+    dictionary holding it along with the byte count, the missing byte
+    values, the Shannon entropy and the chi-square statistic.
+    """
+    return stats_from_histogram(byte_histogram(data))
+
+
+def stats_from_histogram(histogram):
+    """Returns the same dictionary as byte_stats for an existing histogram.
+    """
+    return {
+        'histogram': histogram,
+        'total': int(histogram.sum()),
+        'missing': missing_bytes(histogram),
+        'entropy': shannon_entropy(histogram),
+        'chi_square': chi_square(histogram),
+    }
+
+
+def merge_histograms(histograms):
+    """Adds up the histograms of separate pieces of data, giving the
+    histogram of all of it.
+    """
+    total = np.zeros(256, dtype=np.int64)
+    for histogram in histograms:
+        total += histogram
+    return total
+
+
+def range_histogram(filename, start, end, chunk_size=CHUNK_SIZE):
+    """Returns the histogram of the bytes from start up to end of a file.
+    The range is read into one reused buffer of chunk_size bytes and
+    counted a chunk at a time, so each worker holds a few chunk sizes of
+    memory whatever the size of the file.
+    """
+    histogram = np.zeros(256, dtype=np.int64)
+    if start >= end:
+        return histogram
+    buffer = bytearray(min(chunk_size, end - start))
+    view = memoryview(buffer)
+    with open(filename, 'rb', buffering=0) as fh:
+        fh.seek(start)
+        while start < end:
+            read = fh.readinto(view[:min(len(buffer), end - start)])
+            if not read:
+                break
+            histogram += np.bincount(as_byte_array(view[:read]), minlength=256)
+            start += read
+    return histogram
+
+
+def file_histogram(filename, workers=1, chunk_size=CHUNK_SIZE):
+    """Returns the histogram of a whole file, which may be larger than
+    memory. With more than one worker the file is split into one byte
+    range per worker and the ranges are counted in separate processes.
+    """
+    size = os.path.getsize(filename)
+    if workers <= 1 or size <= chunk_size:
+        return range_histogram(filename, 0, size, chunk_size)
+    step = -(-size // workers)
+    ranges = [(filename, start, min(start + step, size), chunk_size) for start in range(0, size, step)]
+    with Pool(workers) as pool:
+        return merge_histograms(pool.starmap(range_histogram, ranges))
+
+
+def map_file(filename):
+    """Returns a read-only uint8 memory map of a file, so the bytes can be
+    used like an array without reading the file into memory.
+    """
+    if not os.path.getsize(filename):
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(filename, dtype=np.uint8, mode='r')
+
+
+def window_entropy(data, window, stride):
+    """Computes the Shannon entropy and the number of distinct byte values
+    of every window of window bytes, starting every stride bytes, across
+    the data (bytes or a uint8 array such as map_file returns).
+
+    The data is cut into blocks of gcd(window, stride) bytes and a running
+    sum of the block histograms is kept, so each window's histogram is the
+    difference of two running sums rather than a recount of its bytes.
+    The data is handled a chunk at a time to bound memory. Returns two
+    arrays indexed by window number; window i starts at offset i * stride.
+    """
+    if not isinstance(data, np.ndarray):
+        data = as_byte_array(data)
+    count = (len(data) - window) // stride + 1 if len(data) >= window else 0
+    block = math.gcd(window, stride)
+    window_blocks = window // block
+    stride_blocks = stride // block
+    chunk_bytes = max(min(MAX_WINDOW_BLOCKS * block, WINDOW_CHUNK_SIZE), window)
+    windows_per_chunk = (chunk_bytes - window) // stride + 1
+
+    entropies = np.empty(count)
+    coverage = np.empty(count, dtype=np.int16)
+    for first in range(0, count, windows_per_chunk):
+        windows = min(windows_per_chunk, count - first)
+        blocks = ((windows - 1) * stride + window) // block
+        start = first * stride
+        values = np.asarray(data[start:start + blocks * block]).reshape(blocks, block)
+        index = (np.arange(blocks, dtype=np.int64)[:, None] * 256 + values).ravel()
+        histograms = np.bincount(index, minlength=blocks * 256).reshape(blocks, 256).astype(np.int32)
+        running = np.zeros((blocks + 1, 256), dtype=np.int32)
+        np.cumsum(histograms, axis=0, out=running[1:])
+        starts = np.arange(windows) * stride_blocks
+        counts = running[starts + window_blocks] - running[starts]
+        weighted = (counts * np.log2(np.maximum(counts, 1))).sum(axis=1)
+        entropies[first:first + windows] = math.log2(window) - weighted / window
+        coverage[first:first + windows] = np.count_nonzero(counts, axis=1)
+    return entropies, coverage
+
+
+def high_entropy_ranges(entropies, window, stride, threshold):
+    """Joins consecutive windows whose entropy is at least threshold into
+    ranges. Returns a list of (start offset, end offset, peak entropy).
+    """
+    high = np.r_[0, (entropies >= threshold).astype(np.int8), 0]
+    edges = np.flatnonzero(np.diff(high))
+    return [(int(first * stride), int((last - 1) * stride + window), float(entropies[first:last].max()))
+            for first, last in zip(edges[::2], edges[1::2])]
+
+
+def iter_buckets(data, columns, chunk_size=CHUNK_SIZE):
+    """Splits the data into at most columns buckets of consecutive bytes
+    and yields (first bucket, 2-D array of whole buckets) pieces of about
+    chunk_size bytes, plus the last partial bucket as a 2-D array of one
+    row. Used to reduce large memory mapped files a piece at a time.
+    """
+    width = max(1, -(-len(data) // columns))
+    buckets_per_chunk = max(1, chunk_size // width)
+    whole = len(data) // width
+    for first in range(0, whole, buckets_per_chunk):
+        last = min(first + buckets_per_chunk, whole)
+        yield first, np.asarray(data[first * width:last * width]).reshape(last - first, width)
+    if len(data) > whole * width:
+        yield whole, np.asarray(data[whole * width:]).reshape(1, -1)
+
+
+def density_image(data, columns=1024):
+    """Returns a (buckets, 256) array counting how often each byte value
+    occurs in each bucket of consecutive offsets, along with the bucket
+    width. Plotted as an image it shows the layout of data of any size
+    at a fixed cost. Each piece is counted into its own rows only, and a
+    bucket wider than CHUNK_SIZE is counted a chunk at a time.
+    """
+    width = max(1, -(-len(data) // columns))
+    buckets = -(-len(data) // width)
+    image = np.zeros((buckets, 256), dtype=np.int64)
+    for first, values in iter_buckets(data, columns):
+        if values.shape[1] > CHUNK_SIZE:
+            for row, bucket in enumerate(values, first):
+                image[row] += byte_histogram(bucket)
+            continue
+        rows = np.arange(len(values), dtype=np.int32)[:, None] * 256
+        counts = np.bincount((rows + values).ravel(), minlength=len(values) * 256)
+        image[first:first + len(values)] += counts.reshape(len(values), 256)
+    return image, width
+
+
+def minmax_decimate(data, columns=1024):
+    """Returns the lowest and highest byte value in each bucket of
+    consecutive offsets, along with the bucket width, so a line plot of
+    any size of data keeps its peaks with only columns points.
+    """
+    width = max(1, -(-len(data) // columns))
+    buckets = -(-len(data) // width)
+    lows = np.zeros(buckets, dtype=np.uint8)
+    highs = np.zeros(buckets, dtype=np.uint8)
+    for first, values in iter_buckets(data, columns):
+        lows[first:first + len(values)] = values.min(axis=1)
+        highs[first:first + len(values)] = values.max(axis=1)
+    return lows, highs, width
@@ -7,10 +7,16 @@ __description__ = """A program to check byte distribution for a given set of dat
 
 
 import matplotlib.pyplot as plt 
+import numpy as np
 import base64
+import binascii
+import sys
+from itertools import islice
 import urllib.parse
 import argparse
 import os
+import math
+from byte_stats import as_byte_array, byte_stats, density_image, file_histogram, high_entropy_ranges, line_stats, map_file, stats_from_histogram, window_entropy
 
 
 def decode_url_encoding(input_string):
@@ -23,38 +29,10 @@ def decode_url_encoding(input_string):
     return urllib.parse.unquote(input_string).encode()
 
 
-def get_integer_list(input_bytes):
-    """Returns a list of byte integers from a byte-string.
+def plot_histogram(histogram):
+    """Plots a histogram from the given array of 256 byte counts.
     """
-    return [byte for byte in input_bytes]
-
-
-def create_byte_histogram(input_bytes):
-    """Returns a dictionary containing each byte value as a key and the
-    number of times it occures in the input bytes as a value.
-    """
-    bytes_dict = dict()
-    for byte in input_bytes:
-        bytes_dict[byte] = bytes_dict.get(byte, 0) + 1
-    return bytes_dict
-
-    
-def check_byte_representation(bytes_dict):
-    """Generates a list of all possible 256 bytes values and returns any
-    byte value that does not appear as a key in the supplied dictionary.
-    """
-    missing_byte_list = []
-    total_bytes = [byte for byte in range(256)]
-    for byte in total_bytes:
-        if byte not in bytes_dict:
-            missing_byte_list.append(byte)
-    return missing_byte_list
-        
-
-def plot_histogram(data):
-    """Plots a histogram from the given data.
-    """
-    plt.hist(data, color='g')
+    plt.bar(range(256), histogram, color='g')
     plt.title('Byte Histogram')
     plt.ylabel('Occurence')
     plt.xlabel('Byte Values')
@@ -63,25 +41,153 @@ def plot_histogram(data):
 
 
 def plot_scatter(data):
-    """Plots a scatter chart from the given data.
+    """Plots byte values against their offset. The offsets are grouped
+    into 1024 buckets and drawn as an image of how often each byte value
+    occurs in each bucket, so large files plot as fast as small ones.
     """
-    positions = [i for i in range(len(data))]
-    plt.scatter(data_list, positions, edgecolors='r')
+    image, width = density_image(data)
+    plt.imshow(np.log1p(image), aspect='auto', origin='lower', interpolation='nearest',
+               extent=[0, 256, 0, len(image) * width])
     plt.title('Byte Scatter Plot')
-    plt.ylabel('Occurence')
+    plt.ylabel('Offset')
     plt.xlabel('Byte Values')
     plt.xticks(range(0, 256, 10))
     plt.show()
 
 
+def print_stats(stats):
+    """Prints the byte representation, entropy and chi-square results.
+    """
+    print("[+] {} bytes positions are not represented in the data".format(len(stats['missing'])))
+    print("[+] Entropy: {:.4f} bits per byte, chi-square: {:.2f}".format(stats['entropy'], stats['chi_square']))
+
+
+def process_file(filename):
+    """Counts the file in chunks across the requested number of worker
+    processes without reading it into memory.
+    """
+    print("[*] Processing {}...".format(filename))
+    stats = stats_from_histogram(file_histogram(filename, args.workers))
+    if args.plot_histogram:
+        plot_histogram(stats['histogram'])
+    if args.plot_scatter:
+        plot_scatter(map_file(filename))
+    print_stats(stats)
+
+
+def scan_windows(data):
+    """Computes the entropy of a sliding window across the data, prints
+    the ranges whose entropy is above the threshold and optionally writes
+    the full offset, entropy and coverage series to a CSV file.
+    """
+    window = args.sliding_window
+    stride = args.stride or window
+    # Windows shorter than 256 bytes cannot reach 8 bits of entropy
+    threshold = args.threshold or 0.8 * math.log2(min(window, 256))
+    print("[*] Scanning {} bytes with a {} byte window every {} bytes...".format(len(data), window, stride))
+    entropies, coverage = window_entropy(data, window, stride)
+    if args.outfile:
+        with open(args.outfile, 'w') as fh:
+            fh.write('offset,entropy,coverage\n')
+            for i in range(len(entropies)):
+                fh.write('{},{:.4f},{}\n'.format(i * stride, entropies[i], coverage[i]))
+        print("[*] Wrote the entropy of {} windows to {}".format(len(entropies), args.outfile))
+    ranges = high_entropy_ranges(entropies, window, stride, threshold)
+    print("[+] {} ranges with entropy of at least {:.2f} bits per byte".format(len(ranges), threshold))
+    for start, end, peak in ranges:
+        print("    0x{:08x}-0x{:08x} ({} bytes, peak {:.4f})".format(start, end, end - start, peak))
+
+
+def decode_lines(lines):
+    """Applies the requested decoding to a block of lines. Hex is decoded
+    for the whole block in one call when every line is valid and free of
+    whitespace, and line by line otherwise. Lines that cannot be decoded
+    are returned as None.
+    """
+    if args.url_decode:
+        decoded = []
+        for line in lines:
+            try:
+                decoded.append(decode_url_encoding(line))
+            except UnicodeDecodeError:
+                decoded.append(None)
+        lines = decoded
+    if args.b64_decode:
+        decoded = []
+        for line in lines:
+            try:
+                decoded.append(binascii.a2b_base64(line))
+            except (binascii.Error, TypeError, ValueError):
+                decoded.append(None)
+        lines = decoded
+    if args.hex_decode:
+        try:
+            if any(line is None or len(line) % 2 for line in lines):
+                raise ValueError
+            joined = bytes.fromhex(b''.join(lines).decode())
+            # bytes.fromhex skips whitespace, which would shift bytes into
+            # the following lines
+            if len(joined) != sum(len(line) // 2 for line in lines):
+                raise ValueError
+            decoded = []
+            offset = 0
+            for line in lines:
+                decoded.append(joined[offset:offset + len(line) // 2])
+                offset += len(line) // 2
+            lines = decoded
+        except (ValueError, UnicodeDecodeError):
+            decoded = []
+            for line in lines:
+                try:
+                    decoded.append(bytes.fromhex(line.decode()))
+                except (AttributeError, ValueError, UnicodeDecodeError):
+                    decoded.append(None)
+            lines = decoded
+    return lines
+
+
+def process_lines(fh, outfile, block_lines=16384):
+    """Reads lines block_lines at a time, computes the stats of the whole
+    block at once and streams one CSV or JSON record per line.
+    """
+    if args.output_format == 'csv':
+        outfile.write('line,length,entropy,missing\n')
+        record = '{},{},{:.4f},{}\n'
+        failed = '{},,,\n'
+    else:
+        record = '{{"line": {}, "length": {}, "entropy": {:.4f}, "missing": {}}}\n'
+        failed = '{{"line": {}, "error": "decode failed"}}\n'
+    line_number = 1
+    while True:
+        lines = [line.rstrip(b'\r\n') for line in islice(fh, block_lines)]
+        if not lines:
+            break
+        items = decode_lines(lines)
+        valid = [item for item in items if item is not None]
+        lengths, entropies, missing = line_stats(valid)
+        results = iter(zip(lengths.tolist(), entropies.tolist(), missing.tolist()))
+        output = []
+        for item in items:
+            if item is None:
+                output.append(failed.format(line_number))
+            else:
+                output.append(record.format(line_number, *next(results)))
+            line_number += 1
+        outfile.write(''.join(output))
+
+
 def main():
     if args.line_by_line:
-        data = input_data.splitlines()
-        line_number = 1
-    else:
-        data = [input_data]
+        if args.outfile:
+            with open(args.file, 'rb') as fh, open(args.outfile, 'w') as outfile:
+                process_lines(fh, outfile)
+        else:
+            with open(args.file, 'rb') as fh:
+                process_lines(fh, sys.stdout)
+        return
+    data = [input_data]
     for item in data:
-        if type(data) == str:
+        if type(item) == str:
             item = item.encode()
         if args.url_decode:
             item = decode_url_encoding(item)
@@ -89,22 +195,17 @@ def main():
             item = base64.b64decode(item)
         if args.hex_decode:
             item = bytes.fromhex(item.decode())
-        item_list = get_integer_list(item)
-        integer_list = [i for i in range(256)]
+        if args.sliding_window:
+            scan_windows(as_byte_array(item))
+            continue
+        stats = byte_stats(item)
         if args.plot_histogram:
-            plot_histogram(item_list)
+            plot_histogram(stats['histogram'])
         if args.plot_scatter:
-            plot_scatter(item_list)
-        if args.line_by_line:
-            print("\n[*] Processing line {}: {}...".format(line_number, item[:10]))
-            line_number += 1
-        else:
-            print("[*] Processing {}...".format(item[:50]))
-        item_dict = create_byte_histogram(item)
+            plot_scatter(as_byte_array(item))
+        print("[*] Processing {}...".format(item[:50]))
         print("[*] Checking byte representation...")
-        missing_bytes = check_byte_representation(item_dict)
-        missing_byte_count = sum([1 for byte in missing_bytes])
-        print("[+] {} bytes positions are not represented in the data".format(missing_byte_count))
+        print_stats(stats)
 
 
 if __name__ == '__main__':
@@ -129,11 +230,30 @@ if __name__ == '__main__':
                         help="Decode the b64 encoded data.", 
                         action="store_true")
     parser.add_argument("-l", "--line_by_line",
-                        help="Checks entropy of data in a file line by line.",
+                        help="Checks entropy of data in a file line by line, streaming a record per line.",
                         action="store_true")
     parser.add_argument("-x", "--hex_decode",
                         help="Decode the hex encoded data.",
                         action="store_true")
+    parser.add_argument("-w", "--workers",
+                        help="Number of processes used to count a file (default=1).",
+                        type=int,
+                        default=1)
+    parser.add_argument("-sw", "--sliding_window",
+                        help="Report the entropy of a window of this many bytes slid across the data.",
+                        type=int)
+    parser.add_argument("-st", "--stride",
+                        help="Number of bytes the sliding window moves each step (default=window size).",
+                        type=int)
+    parser.add_argument("-t", "--threshold",
+                        help="Entropy at or above which sliding windows are reported (default=80%% of the maximum for the window size).",
+                        type=float)
+    parser.add_argument("-of", "--output_format",
+                        help="Record format for -l results (default=csv).",
+                        choices=['csv', 'jsonl'],
+                        default='csv')
+    parser.add_argument("-o", "--outfile",
+                        help="Write the -l records, or the offset, entropy and coverage of every sliding window, to a file.")
     args = parser.parse_args()
 
     if not args.data and not args.file:
@@ -144,15 +264,28 @@ if __name__ == '__main__':
         parser.print_help()
         print('\n[-] Please specify either -d or -f, not both.\n')
         exit()
+    if args.sliding_window is not None and (args.sliding_window < 1 or (args.stride is not None and args.stride < 1)):
+        parser.print_help()
+        print('\n[-] The sliding window and stride must be at least 1 byte.\n')
+        exit()
     if args.data:
         if args.line_by_line:
             print('\n[-] -l option only available with -f.\n')
+            exit()
         input_data = args.data
     if args.file:
         if not os.path.exists(args.file):
             print("\n[-] The file cannot be found or you do not have permission to open the file. Please check the path and try again\n")
             exit()
-        else:
+        elif args.sliding_window and not (args.line_by_line or args.url_decode or args.b64_decode or args.hex_decode):
+            scan_windows(map_file(args.file))
+            exit()
+        elif args.line_by_line:
+            input_data = None
+        elif args.url_decode or args.b64_decode or args.hex_decode:
             with open(args.file, 'rb') as fh:
                 input_data = fh.read()
+        else:
+            process_file(args.file)
+            exit()
     main()
\ No newline at end of file
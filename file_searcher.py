@@ -3,9 +3,29 @@
 
 import os
 import argparse
+import csv
+import gzip
+import io
+import json
+import mmap
 import sys
 import re
+import sqlite3
+import tarfile
+import threading
+import zipfile
+import zlib
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import cpu_count
 from platform import system
+from queue import Queue
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 __author__ = 'Jake Miller'
@@ -16,6 +36,41 @@ __description__ = ''' Recurses through directories searching for file names
                       a security perspective. '''
 
 
+# Number of paths handed to a worker at a time
+BATCH_SIZE = 64
+
+# Number of bytes of a mapped file searched at a time, and the length of
+# the first block sniffed to tell binary files apart from text
+CHUNK_SIZE = 8 * 1024 * 1024
+SNIFF_SIZE = 8192
+
+# Number of bytes of context reported after each hit
+CONTEXT_SIZE = 60
+
+# Lists of more strings than this are searched through tables of the
+# first PREFILTER_GRAM bytes of each string, hashed into 2**PREFILTER_BITS
+# slots, so the pattern is only tried where a string may start. Strings
+# shorter than PREFILTER_GRAM get a table for their own length. The
+# tables are looked up PREFILTER_PIECE bytes at a time to bound memory
+PREFILTER_MIN_STRINGS = 64
+PREFILTER_GRAM = 4
+PREFILTER_BITS = 20
+PREFILTER_PIECE = 1024 * 1024
+
+# Bumped whenever the layout or meaning of the index changes
+INDEX_VERSION = 1
+
+# Archives searched member by member with -sa. Members are reported as
+# archive!/member, the way Java names classpath resources
+ZIP_EXTENSIONS = ('.zip', '.jar', '.war', '.ear')
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz')
+ARCHIVE_ERRORS = (zipfile.BadZipFile, zipfile.LargeZipFile, tarfile.TarError, zlib.error,
+                  EOFError, RuntimeError, NotImplementedError)
+
+# Columns of the records written with -of csv or jsonl
+RECORD_FIELDS = ['path', 'kind', 'string', 'offset', 'context']
+
+
 def interesting_filename_list():
     """Returns a list of string to help determine files of interest.
     """
@@ -35,31 +90,227 @@ def interesting_strings_list():
     return interesting_strings 
 
 
-def has_interesting_content(filepath):
+def trie_regex(words):
+    """Builds a regular expression that matches any of the words. Words
+    with a common prefix share a branch, like a trie, so the cost of a
+    match grows with the length of the words rather than their number.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')' + ('?' if '' in node else '')
+
+    return build(trie)
+
+
+@lru_cache(maxsize=None)
+def get_matcher(wordlist=None):
+    """Compiles the interesting strings, or the strings in a wordlist file,
+    into one bytes pattern of lowercased strings that finds all of them in
+    a single pass over lowercased contents, which is far faster than a
+    case insensitive pattern. The context after a hit is matched in a
+    lookahead so hits that are close together are all reported. Returns
+    the pattern, a dictionary mapping each lowercased hit back to its
+    string and the length of the longest hit. Cached, so each worker
+    compiles it once.
+    """
+    if wordlist:
+        with open(wordlist, encoding='utf-8', errors='replace') as fh:
+            strings = [line.strip() for line in fh if line.strip()]
+    else:
+        strings = interesting_strings_list()
+    lookup = {string.lower().encode('utf-8'): string for string in strings}
+    regex = '(?P<hit>' + trie_regex(hit.decode('latin-1') for hit in lookup) + ')'
+    regex += '(?=(?P<context>.{1,%d}))' % CONTEXT_SIZE
+    pattern = re.compile(regex.encode('latin-1'))
+    return pattern, lookup, max(map(len, lookup)), build_prefilter(lookup)
+
+
+def gram_keys(values, gram):
+    """Returns the slot in the prefilter table of the gram bytes starting
+    at each offset of a uint8 array that has room for them.
+    """
+    count = len(values) - gram + 1
+    keys = np.zeros(max(count, 0), dtype=np.uint32)
+    for index in range(gram):
+        keys <<= np.uint32(8)
+        keys |= values[index:index + count]
+    keys *= np.uint32(0x9E3779B1)
+    return keys >> np.uint32(32 - PREFILTER_BITS)
+
+
+def build_prefilter(lookup):
+    """Builds the tables of the first bytes of each lowercased string used
+    by search_buffer to skip offsets where no string starts. Returns a
+    list of (number of bytes, table) pairs, or None when NumPy is not
+    installed or the list is short enough for the pattern on its own.
+    """
+    if np is None or len(lookup) <= PREFILTER_MIN_STRINGS:
+        return None
+    prefixes = {}
+    for hit in lookup:
+        prefixes.setdefault(min(len(hit), PREFILTER_GRAM), set()).add(hit[:PREFILTER_GRAM])
+    tables = []
+    for gram, grams in sorted(prefixes.items()):
+        table = np.zeros(1 << PREFILTER_BITS, dtype=bool)
+        table[gram_keys(np.frombuffer(b''.join(grams), dtype=np.uint8), gram)[::gram]] = True
+        tables.append((gram, table))
+    return tables
+
+
+def candidate_offsets(data, prefilter, end):
+    """Yields the offsets before end in lowercased bytes where the first
+    bytes hash to a slot of one of the prefilter tables, in increasing
+    order.
+    """
+    values = np.frombuffer(data, dtype=np.uint8)
+    for start in range(0, end, PREFILTER_PIECE):
+        stop = min(start + PREFILTER_PIECE, end)
+        found = np.zeros(stop - start, dtype=bool)
+        for gram, table in prefilter:
+            keys = gram_keys(values[start:stop + gram - 1], gram)
+            found[:len(keys)] |= table[keys[:stop - start]]
+        yield from (np.flatnonzero(found) + start).tolist()
+
+
+def is_binary(block):
+    """Returns True if a block of bytes looks like it came from a binary
+    file rather than text, going by the NUL bytes text files never hold.
+    """
+    return b'\0' in block
+
+
+def find_hits(pattern, lowered, prefilter):
+    """Yields the non-overlapping matches of the pattern in lowercased
+    bytes, like finditer. With a prefilter table the pattern is only tried
+    at the offsets where the first bytes of some string may start.
+    """
+    if prefilter is None:
+        yield from pattern.finditer(lowered)
+        return
+    end = 0
+    for start in candidate_offsets(lowered, prefilter, len(lowered)):
+        if start < end:
+            continue
+        match = pattern.match(lowered, start)
+        if match:
+            end = match.end()
+            yield match
+
+
+def search_buffer(data, wordlist=None, include_binary=False):
+    """Searches bytes, or a memory mapped file, for interesting strings.
+
+    The data is searched CHUNK_SIZE bytes at a time, so only one chunk is
+    copied at a time. Each chunk is extended by the longest string plus
+    the context, and only hits that start inside the chunk itself are
+    kept, so hits that span the end of a chunk are found once. Binary
+    data is skipped unless include_binary is set.
+
+    Returns a list of (string, offset, context) tuples for each hit, where
+    offset is in bytes and context is the hit along with up to 60 bytes
+    after it.
+    """
+    pattern, lookup, longest, prefilter = get_matcher(wordlist)
+    hits = []
+    if not include_binary and is_binary(data[:SNIFF_SIZE]):
+        return hits
+    overlap = longest + CONTEXT_SIZE
+    for offset in range(0, len(data), CHUNK_SIZE):
+        chunk = data[offset:offset + CHUNK_SIZE + overlap]
+        for match in find_hits(pattern, chunk.lower(), prefilter):
+            if match.start() >= CHUNK_SIZE:
+                break
+            context = chunk[match.start():match.end('context')].decode('utf-8', errors='replace')
+            hits.append((lookup[match.group('hit')], offset + match.start(), context))
+    return hits
+
+
+def has_interesting_content(filepath, wordlist=None, max_size=None, include_binary=False):
     """Reads the contents of a file and see if interesting strings are 
     present.
 
-    Returns the filename where the string was located along with data around
-    the string for context.
+    The file is memory mapped and passed to search_buffer, so memory use
+    does not grow with the size of the file. Files larger than max_size
+    bytes are skipped. Returns the hits found by search_buffer.
+    """
+    with open(filepath, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if not size or (max_size and size > max_size):
+            return []
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return search_buffer(mapped, wordlist, include_binary)
+
+
+def archive_type(filename):
+    """Returns 'zip' or 'tar' if the name of a file is that of an archive
+    that can be searched, otherwise None.
+    """
+    filename = filename.lower()
+    if filename.endswith(ZIP_EXTENSIONS):
+        return 'zip'
+    if filename.endswith(TAR_EXTENSIONS):
+        return 'tar'
+    return None
+
+
+def iter_members(fileobj, kind, member_size):
+    """Yields the name and contents of each regular file in a zip or tar
+    archive, read into memory one at a time. Tar archives are read as a
+    stream, compressed or not. Members larger than member_size bytes are
+    yielded with None as their contents.
+    """
+    if kind == 'zip':
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                yield info.filename, archive.read(info) if info.file_size <= member_size else None
+    else:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                yield info.name, archive.extractfile(info).read() if info.size <= member_size else None
+
+
+def search_archive(path, fileobj, kind, depth, search_filenames, search_contents, wordlist,
+                   include_binary, member_size):
+    """Searches the members of an archive in memory, without extracting
+    them to disk, and archives nested inside it until depth runs out.
+    Returns a list of (member path, interesting name, content, error)
+    tuples for the members worth reporting.
     """
-    interesting_strings = interesting_strings_list()
+    results = []
     try:
-        if sys.version.startswith('3'):
-            with open(filepath, encoding='utf-8', errors='replace') as fh:
-                contents = fh.read()
-        else:
-            with open(filepath) as fh:
-                contents = fh.read()
-    except Exception as e:
-        if args.verbose:
-            print('Error on {}: {}'.format(filepath, e))
-        return
-    context = []
-    for string in interesting_strings:
-        regex = "(?:(?i)" + string + ").{1,60}"
-        matches = (re.findall(regex, contents))
-        context += [item for item in matches]
-    return context
+        for name, data in iter_members(fileobj, kind, member_size):
+            member_path = path + '!/' + name
+            interesting_name = bool(search_filenames and is_interesting_filename(os.path.basename(name)))
+            content, error, nested = [], None, []
+            if data is None:
+                error = 'member larger than the size limit, skipped'
+            elif archive_type(name) and depth > 1:
+                nested = search_archive(member_path, io.BytesIO(data), archive_type(name), depth - 1,
+                                        search_filenames, search_contents, wordlist, include_binary,
+                                        member_size)
+            elif search_contents:
+                content = search_buffer(data, wordlist, include_binary)
+            if interesting_name or content or error:
+                results.append((member_path, interesting_name, content, error))
+            results += nested
+    except ARCHIVE_ERRORS as e:
+        results.append((path, False, [], 'cannot read archive: {}'.format(e)))
+    return results
 
 
 def is_interesting_filename(filename):
@@ -74,67 +325,315 @@ def is_interesting_filename(filename):
             continue
 
 
+def walk_files(root_dir):
+    """Yields the path of every file below root_dir. Uses os.scandir with
+    an explicit stack of directories, which avoids the extra stat calls
+    os.walk makes and copes with trees of any depth.
+    """
+    directories = [root_dir]
+    while directories:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                        elif entry.is_file():
+                            yield entry.path
+                    except OSError:
+                        continue
+        except OSError as e:
+            if args.verbose:
+                print('Error on {}: {}'.format(directory, e))
+
+
+def file_signature(path):
+    """Returns the size, modification time and inode of a file, which
+    change whenever the file is rewritten or replaced, or None if the file
+    cannot be read.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def index_options(wordlist, *options):
+    """Returns a string describing the options that decide what a search
+    finds, including the version of any wordlist file. An index built
+    with different options is cleared rather than reused.
+    """
+    return json.dumps([INDEX_VERSION, args.search_filenames, args.search_contents,
+                       wordlist and [os.path.abspath(wordlist), file_signature(wordlist)],
+                       options])
+
+
+def open_index(filename, options=None):
+    """Opens the SQLite index of earlier results, creating it if needed.
+    The index uses write-ahead logging so the producer thread can look up
+    files while the main thread records new results. When options are
+    given and differ from those the index was built with, the index is
+    cleared.
+    """
+    index = sqlite3.connect(filename)
+    index.execute('PRAGMA journal_mode=WAL')
+    index.execute('PRAGMA synchronous=NORMAL')
+    if options is not None:
+        index.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        index.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, '
+                      'mtime INTEGER, inode INTEGER, interesting_name INTEGER, content TEXT)')
+        row = index.execute("SELECT value FROM meta WHERE key = 'options'").fetchone()
+        if not row or row[0] != options:
+            if row and args.verbose:
+                print('[*] Search options changed, clearing the index {}'.format(filename))
+            index.execute('DELETE FROM files')
+            index.execute("INSERT OR REPLACE INTO meta VALUES ('options', ?)", (options,))
+        index.commit()
+    return index
+
+
+def lookup_index(index, path, signature):
+    """Returns the stored results of a file, and of any archive members
+    stored under it, if the index holds them for the same signature,
+    otherwise None. Stored results carry no signature, so they are not
+    written back.
+    """
+    row = index.execute('SELECT path, size, mtime, inode, interesting_name, content FROM files WHERE path = ?',
+                        (path,)).fetchone()
+    if not row or tuple(row[1:4]) != signature:
+        return None
+    rows = [row]
+    if archive_type(path):
+        rows += index.execute('SELECT path, size, mtime, inode, interesting_name, content FROM files '
+                              'WHERE path >= ? AND path < ? ORDER BY rowid', (path + '!/', path + '!0'))
+    return [(row[0], None, bool(row[4]), [tuple(hit) for hit in json.loads(row[5])], None) for row in rows]
+
+
+def update_index(index, results):
+    """Records the results of a batch that were searched without error,
+    first dropping the stored members of any archive searched again.
+    """
+    index.executemany('DELETE FROM files WHERE path >= ? AND path < ?',
+                      [(path + '!/', path + '!0') for path, signature, *result in results
+                       if signature and '!/' not in path and archive_type(path)])
+    index.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                      [(path,) + signature + (interesting_name, json.dumps(content))
+                       for path, signature, interesting_name, content, error in results
+                       if signature and not error])
+    index.commit()
+
+
+def produce_batches(paths, batch_queue, index_filename=None):
+    """Runs in its own thread. Groups paths into batches and puts them on
+    a bounded queue, so walking the filesystem overlaps with searching it
+    without getting far ahead of the workers. A None marks the end.
+
+    Each batch is a tuple of whether it holds stored results and a list.
+    With an index, files whose signature matches the index are put in
+    batches of their stored results, and only the rest are left to be
+    searched, as (path, signature) tuples. Batches are cut whenever the
+    kind changes so the order of the files is kept.
+    """
+    index = open_index(index_filename) if index_filename else None
+    batch, stored = [], False
+    for path in paths:
+        signature = result = None
+        if index:
+            signature = file_signature(path)
+            result = signature and lookup_index(index, path, signature)
+        if batch and (result is not None) != stored or len(batch) >= BATCH_SIZE:
+            batch_queue.put((stored, batch))
+            batch = []
+        stored = result is not None
+        if stored:
+            batch += result
+        else:
+            batch.append((path, signature))
+    if batch:
+        batch_queue.put((stored, batch))
+    batch_queue.put(None)
+    if index:
+        index.close()
+
+
+def search_file(path, signature, search_filenames, search_contents, wordlist, max_size, include_binary,
+                archive_depth, member_size):
+    """Runs in a worker. Checks the name and, if requested, the contents of
+    a file, or with an archive_depth the members of an archive. Returns a
+    list of results, each a tuple of the path, the file's signature,
+    whether the name is interesting, the content matches and any error
+    raised while reading the file. The file itself comes first, followed
+    by any archive members worth reporting.
+    """
+    interesting_name = bool(search_filenames and is_interesting_filename(os.path.basename(path)))
+    content, error, members = [], None, []
+    try:
+        kind = archive_depth and archive_type(path)
+        if kind and not (max_size and os.path.getsize(path) > max_size):
+            with open(path, 'rb') as fh:
+                members = search_archive(path, fh, kind, archive_depth, search_filenames, search_contents,
+                                         wordlist, include_binary, member_size)
+        elif search_contents:
+            content = has_interesting_content(path, wordlist, max_size, include_binary)
+    except (OSError, ValueError) as e:
+        error = str(e)
+    return [(path, signature, interesting_name, content, error)] + [
+        (member_path, signature, *member) for member_path, *member in members]
+
+
+def search_batch(entries, *options):
+    """Runs in a worker. Searches a batch of (path, signature) tuples,
+    passing the options on to search_file.
+    """
+    return [result for path, signature in entries for result in search_file(path, signature, *options)]
+
+
+def report(results, index=None):
+    """Writes the results of a batch to the index and hands them to the
+    writer thread.
+    """
+    if index:
+        update_index(index, results)
+    result_queue.put(results)
+
+
+def open_output(filename, output_format):
+    """Opens the output file for appending, compressed with gzip if the
+    name ends in .gz. A CSV file gets a header row when it is new.
+    """
+    new = not os.path.exists(filename) or not os.path.getsize(filename)
+    opener = gzip.open if filename.endswith('.gz') else open
+    fh = opener(filename, 'at', encoding='utf-8', errors='replace', newline='')
+    if new and output_format == 'csv':
+        csv.writer(fh).writerow(RECORD_FIELDS)
+    return fh
+
+
+def iter_records(results):
+    """Yields a (path, kind, string, offset, context) record for each
+    interesting file name and each content match in a batch of results.
+    """
+    for path, signature, interesting_name, content, error in results:
+        if interesting_name:
+            yield path, 'name', None, None, None
+        for string, offset, context in content:
+            yield path, 'content', string, offset, context
+
+
+def format_output(results, output_format):
+    """Formats a batch of results for the output file as one string, as
+    indented text like the terminal output, CSV rows or JSON lines.
+    """
+    if output_format == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(iter_records(results))
+        return buffer.getvalue()
+    if output_format == 'jsonl':
+        return ''.join(json.dumps(dict(zip(RECORD_FIELDS, record))) + '\n' for record in iter_records(results))
+    return format_text(results, False)
+
+
+def format_text(results, errors):
+    """Formats a batch of results as the lines printed to the terminal:
+    each interesting path followed by its matches, and any errors if
+    errors is set.
+    """
+    lines = []
+    for path, signature, interesting_name, content, error in results:
+        if error and errors:
+            lines.append('Error on {}: {}\n'.format(path, error))
+        if not (interesting_name or content):
+            continue
+        lines.append(path + "\n")
+        for string, offset, context in content:
+            lines.append("    [{}] {}\n".format(string, context))
+    return ''.join(lines)
+
+
+def write_results(result_queue):
+    """Runs in its own thread. Takes batches of results off a queue, along
+    with any other batches already waiting, and prints and writes each
+    group with a single call, so neither the search nor the main thread
+    ever waits on the terminal or the disk. A None marks the end.
+    """
+    done = False
+    while not done:
+        batches = [result_queue.get()]
+        while not result_queue.empty() and len(batches) < BATCH_SIZE:
+            batches.append(result_queue.get())
+        if batches[-1] is None:
+            done = True
+            batches.pop()
+        results = [result for batch in batches for result in batch]
+        sys.stdout.write(format_text(results, args.verbose))
+        sys.stdout.flush()
+        if args.write_to_file:
+            outfile.write(format_output(results, args.output_format))
+
+
 def main():
     """Searches files from a specified file listing, or recurses the
     filesystem to look for interesting file names or strings within
     the files.
-    """
-    # Lots of repeat code. Need to fix.
 
-    # Reads files from a file list and perfroms searches
-    if args.file_list:
-        filenames = open(args.file_list).read().splitlines()
-        for filename in filenames:
-
-            if args.search_filenames:
-                is_interesting = is_interesting_filename(filename)
-                if is_interesting:
-                    print(filename)
-
-            if args.search_contents:
-                interesting_content = has_interesting_content(filename)
-                if interesting_content:
-                    if not args.search_filenames:
-                        print(filename)
-                    for item in interesting_content:
-                        print("    " + item)
-
-            if args.write_to_file:
-                if args.search_contents:
-                    if interesting_content:
-                        outfile.write(filename + "\n")
-                        for item in interesting_content:
-                            outfile.write("    " + item + "\n")
-                else:
-                    outfile.write(filename + "\n")
+    A producer thread walks the filesystem (or reads the file listing)
+    and feeds batches of paths through a bounded queue to a pool of
+    worker processes, or threads with -t for I/O bound network shares.
+    The main thread collects the results, in the order the files were
+    found unless -u is given, and a writer thread prints and writes them.
 
-    # Traverses the filesystem and conducts searches
+    With -ix the results are kept in an index, and on later runs files
+    whose size, modification time and inode are unchanged are reported
+    from the index without being opened.
+    """
+    if args.file_list:
+        paths = (line.rstrip('\r\n') for line in open(args.file_list))
     else:
-        for root, dirnames, filenames in os.walk(root_dir):
-            for filename in filenames:
+        paths = walk_files(root_dir)
 
-                if args.search_filenames:
-                    is_interesting = is_interesting_filename(filename)
-                    if is_interesting:
-                        print(os.path.join(root, filename))
+    index = None
+    if args.index:
+        index = open_index(args.index, index_options(args.interesting_strings, max_size, args.include_binary,
+                                                     archive_depth, member_size))
 
-                if args.search_contents:
-                    interesting_content = has_interesting_content(os.path.join(root, filename))
-                    if interesting_content:
-                        if not args.search_filenames:
-                            print(os.path.join(root, filename))
-                        for item in interesting_content:
-                            print("    " + item)
-
-                if args.write_to_file:
-                    if args.search_contents:
-                        if interesting_content:
-                            outfile.write(os.path.join(root, filename) + "\n")
-                            for item in interesting_content:
-                                outfile.write("    " + item + "\n")
-                    else:
-                        outfile.write(os.path.join(root, filename) + "\n")
+    batch_queue = Queue(maxsize=args.workers * 4)
+    producer = threading.Thread(target=produce_batches, args=(paths, batch_queue, args.index), daemon=True)
+    producer.start()
+    writer = threading.Thread(target=write_results, args=(result_queue,), daemon=True)
+    writer.start()
 
+    executor_class = ThreadPoolExecutor if args.threads else ProcessPoolExecutor
+    pending = deque()
+    with executor_class(max_workers=args.workers) as executor:
+        while True:
+            item = batch_queue.get()
+            if item is None:
+                break
+            stored, batch = item
+            if stored:
+                future = Future()
+                future.set_result(batch)
+            else:
+                future = executor.submit(search_batch, batch, args.search_filenames, args.search_contents,
+                                         args.interesting_strings, max_size, args.include_binary,
+                                         archive_depth, member_size)
+            pending.append(future)
+            while len(pending) >= args.workers * 2:
+                if args.unordered:
+                    done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        report(future.result(), index)
+                    pending = deque(not_done)
+                else:
+                    report(pending.popleft().result(), index)
+        for future in pending:
+            report(future.result(), index)
+    result_queue.put(None)
+    writer.join()
+    if index:
+        index.close()
 
 
 if __name__ == '__main__': 
@@ -143,8 +642,19 @@ if __name__ == '__main__':
     parser.add_argument("-sc", "--search_contents", help="search only the contents of files for interesting strings", action="store_true")
     parser.add_argument("-sf", "--search_filenames", help="search only the filenames only for interesting strings", action="store_true")
     parser.add_argument("-d", "--directory", nargs='?', const='./', help="specify the directory to begin searching")
-    parser.add_argument("-w", "--write_to_file", nargs='?', const='file_searcher_output', help="writes output to a file")
+    parser.add_argument("-w", "--write_to_file", nargs='?', const='file_searcher_output', help="writes output to a file, compressed if the name ends in .gz")
+    parser.add_argument("-of", "--output_format", choices=['text', 'csv', 'jsonl'], default='text', help="format of the output file (default=text)")
     parser.add_argument("-fl","--file_list", help="Read a list of filenames to perform the search.")
+    parser.add_argument("-n", "--workers", type=int, default=cpu_count(), help="specify the number of workers (default=number of cores)")
+    parser.add_argument("-t", "--threads", help="use threads instead of processes, for I/O bound network shares", action="store_true")
+    parser.add_argument("-u", "--unordered", help="write results as soon as they are found instead of in the order the files were found", action="store_true")
+    parser.add_argument("-is", "--interesting_strings", help="Read the strings to search file contents for from a file, one per line.")
+    parser.add_argument("-ms", "--max_size", type=float, help="skip the contents of files larger than this many megabytes")
+    parser.add_argument("-ib", "--include_binary", help="search the contents of binary files too", action="store_true")
+    parser.add_argument("-sa", "--search_archives", help="search inside zip, jar, war, ear and tar(.gz) archives in memory", action="store_true")
+    parser.add_argument("-ad", "--archive_depth", type=int, default=3, help="how many levels of nested archives to search with -sa (default=3)")
+    parser.add_argument("-am", "--archive_member_size", type=float, default=64, help="skip archive members larger than this many megabytes (default=64)")
+    parser.add_argument("-ix", "--index", nargs='?', const='file_searcher_index.db', help="keep results in an index file and only search new or changed files on later runs")
     args = parser.parse_args()
 
     if not(args.search_filenames or args.search_contents):
@@ -158,6 +668,22 @@ if __name__ == '__main__':
             print("\n[-] The file cannot be found or you do not have permission to open the file. Please check the path and try again\n")
             exit()
 
+    if args.interesting_strings and not os.path.exists(args.interesting_strings):
+        parser.print_help()
+        print("\n[-] The interesting strings file cannot be found. Please check the path and try again\n")
+        exit()
+
+    if args.interesting_strings:
+        with open(args.interesting_strings, encoding='utf-8', errors='replace') as fh:
+            if not any(line.strip() for line in fh):
+                parser.print_help()
+                print("\n[-] The interesting strings file holds no strings. Please add one string per line and try again\n")
+                exit()
+
+    max_size = int(args.max_size * 1024 * 1024) if args.max_size else None
+    archive_depth = args.archive_depth if args.search_archives else 0
+    member_size = int(args.archive_member_size * 1024 * 1024)
+
     if args.directory:
         root_dir = args.directory
     else:
@@ -170,9 +696,11 @@ if __name__ == '__main__':
         sep = '/'
 
     if args.write_to_file:
-        if sys.version.startswith('3'):
-            outfile = open(args.write_to_file, 'a', encoding='utf-8', errors='replace')
-        else:
-            outfile = open(args.write_to_file, 'a')
-    
-    main()
\ No newline at end of file
+        outfile = open_output(args.write_to_file, args.output_format)
+
+    result_queue = Queue(maxsize=args.workers * 4)
+
+    main()
+
+    if args.write_to_file:
+        outfile.close()
\ No newline at end of file
@@ -1,22 +1,336 @@
-import sys
+import argparse
+import errno
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate, repeat
+from multiprocessing import cpu_count
+
 import numpy
 
-if len(sys.argv) != 3:
-    print("\nUsage: file_splitter.py <input_file> <number of files to split the inputfile into>")
-    print("Example: file_splitter.py big_file.txt 5")
-    print("Makes a copy of big_file.txt and splits it into 5 new files.")
-    exit()
-
-filename = sys.argv[1]
-num_files = int(sys.argv[2])
-
-lines = open(filename).read().splitlines()
-splits = numpy.array_split(lines, num_files)
-
-counter = 1
-for list in splits:
-    fh = open(str(counter) + "_" + filename, 'w')
-    for line in list:
-        fh.write(line + '\n')
-    fh.close()
-    counter += 1
\ No newline at end of file
+
+__description__ = '''Splits a file into smaller files on line boundaries. The file is
+read and written in large blocks, so files larger than memory can be
+split. Example: file_splitter.py big_file.txt 5 makes a copy of
+big_file.txt split into 5 new files, 1_big_file.txt to 5_big_file.txt.'''
+
+
+# Number of bytes read and written at a time
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# Round robin splits every block into a list of lines, which takes many
+# times the size of the block, so it reads smaller blocks
+ROUND_ROBIN_BLOCK_SIZE = 2 * 1024 * 1024
+
+# Errors from os.copy_file_range and os.sendfile that mean the files do
+# not support copying in the kernel, so the copy falls back to reads and
+# writes
+KERNEL_COPY_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSOCK, errno.EBADF)
+
+
+def output_name(filename, counter):
+    """Returns the name of the counter'th output file.
+    """
+    return str(counter) + "_" + os.path.basename(filename)
+
+
+def newline_offsets(block):
+    """Returns the offset of every newline in a block of bytes.
+    """
+    return numpy.flatnonzero(numpy.frombuffer(block, dtype=numpy.uint8) == 10)
+
+
+def ends_with_newline(fh, size):
+    """Returns True if a file is empty or its last byte is a newline.
+    """
+    if not size:
+        return True
+    fh.seek(size - 1)
+    return fh.read(1) == b'\n'
+
+
+def count_newlines(fh):
+    """Counts the newlines of a file in one pass of block reads. Returns
+    the count of each BLOCK_SIZE block, so the blocks holding a given
+    line can be found again without another pass.
+    """
+    fh.seek(0)
+    return [block.count(b'\n') for block in iter(lambda: fh.read(BLOCK_SIZE), b'')]
+
+
+def line_ends(fh, block_counts, line_numbers):
+    """Returns the offset just past the newline ending each of an
+    increasing list of line numbers, counted from 1. Only the blocks that
+    hold one of the lines are read. Line number 0 ends at offset 0, and
+    line numbers past the last newline end at the end of the file.
+    """
+    offsets = []
+    line_numbers = iter(line_numbers)
+    number = next(line_numbers, None)
+    while number == 0:
+        offsets.append(0)
+        number = next(line_numbers, None)
+    seen = 0
+    for block_number, count in enumerate(block_counts):
+        newlines = None
+        while number is not None and seen + count >= number:
+            if newlines is None:
+                fh.seek(block_number * BLOCK_SIZE)
+                newlines = newline_offsets(fh.read(BLOCK_SIZE))
+            offsets.append(block_number * BLOCK_SIZE + int(newlines[number - seen - 1]) + 1)
+            number = next(line_numbers, None)
+        seen += count
+    size = os.fstat(fh.fileno()).st_size
+    while number is not None:
+        offsets.append(size)
+        number = next(line_numbers, None)
+    return offsets
+
+
+def next_line_start(fh, offset, size):
+    """Returns the offset of the first line that starts at or after offset.
+    """
+    if offset <= 0 or offset >= size:
+        return min(max(offset, 0), size)
+    fh.seek(offset - 1)
+    while True:
+        block = fh.read(65536)
+        if not block:
+            return size
+        found = block.find(b'\n')
+        if found != -1:
+            return offset + found
+        offset += len(block)
+
+
+def previous_line_start(fh, offset, floor):
+    """Returns the offset of the last line that starts after floor and at
+    or before offset, or None if no line does.
+    """
+    end = offset
+    while end > floor:
+        start = max(floor, end - 65536)
+        fh.seek(start)
+        found = fh.read(end - start).rfind(b'\n')
+        if found != -1:
+            return start + found + 1
+        end = start
+    return None
+
+
+def kernel_copy(source, destination, offset, count):
+    """Copies count bytes from offset in the source file descriptor to the
+    current position of the destination inside the kernel, with
+    os.copy_file_range where Python has it and os.sendfile otherwise.
+    Returns the number of bytes copied.
+    """
+    if hasattr(os, 'copy_file_range'):
+        return os.copy_file_range(source, destination, count, offset)
+    return os.sendfile(destination, source, offset, count)
+
+
+def copy_range(fh, outfile, start, end):
+    """Copies the bytes from start up to end of a file to the output file.
+    The kernel copies them where it can, so they never pass through
+    Python, otherwise they are read and written a block at a time.
+    """
+    try:
+        while start < end:
+            copied = kernel_copy(fh.fileno(), outfile.fileno(), start, min(end - start, 1 << 30))
+            if not copied:
+                break
+            start += copied
+        return
+    except (AttributeError, OSError) as e:
+        if isinstance(e, OSError) and e.errno not in KERNEL_COPY_ERRORS:
+            raise
+    fh.seek(start)
+    while start < end:
+        block = fh.read(min(BLOCK_SIZE, end - start))
+        if not block:
+            break
+        outfile.write(block)
+        start += len(block)
+
+
+def write_range(input_file, output_file, start, end, add_newline):
+    """Runs in a worker thread. Copies one byte range of the input file to
+    an output file through its own unbuffered file handles, adding a
+    newline to the end if add_newline is set.
+    """
+    with open(input_file, 'rb', buffering=0) as fh, open(output_file, 'wb', buffering=0) as outfile:
+        copy_range(fh, outfile, start, end)
+        if add_newline:
+            outfile.write(b'\n')
+
+
+def write_ranges(fh, filename, cuts, size, workers=1):
+    """Writes the bytes between each pair of consecutive cut offsets to its
+    own numbered output file, copying workers ranges at a time so fast
+    disks are kept busy. A newline is added to the last file if the input
+    does not end with one.
+    """
+    missing_newline = not ends_with_newline(fh, size)
+    ranges = [(filename, output_name(filename, counter), start, end, end == size and missing_newline and end > start)
+              for counter, (start, end) in enumerate(zip(cuts, cuts[1:]), 1)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(write_range, *item) for item in ranges]:
+            future.result()
+    return len(ranges)
+
+
+def write_lines(fh, filename, line_counts):
+    """Streams the lines of a file into numbered output files, the first
+    holding line_counts[0] lines, the next line_counts[1] lines and so
+    on. A count of None takes the rest of the file. The newlines of each
+    block are located once with NumPy, so cutting a block many times is
+    no slower than cutting it once. Returns the number of files written.
+    """
+    line_counts = iter(line_counts)
+    counter, outfile, remaining, last = 0, None, 0, b'\n'
+    fh.seek(0)
+    for block in iter(lambda: fh.read(BLOCK_SIZE), b''):
+        newlines = None
+        used, start = 0, 0
+        while start < len(block):
+            if outfile is None or remaining == 0:
+                if outfile:
+                    outfile.close()
+                remaining = next(line_counts)
+                counter += 1
+                outfile = open(output_name(filename, counter), 'wb')
+            if remaining is not None and newlines is None:
+                newlines = newline_offsets(block)
+            if remaining is None or len(newlines) - used < remaining:
+                outfile.write(block[start:])
+                if remaining is not None:
+                    remaining -= len(newlines) - used
+                break
+            end = int(newlines[used + remaining - 1]) + 1
+            outfile.write(block[start:end])
+            used += remaining
+            remaining, start = 0, end
+        last = block[-1:]
+    if outfile:
+        if last != b'\n':
+            outfile.write(b'\n')
+        outfile.close()
+    return counter
+
+
+def split_lines(fh, filename, size, num_files, workers=1):
+    """Splits a file into num_files files of equal numbers of lines, the
+    first files taking one extra line when the lines do not divide evenly.
+    Counts the lines in one pass, reads only the blocks where the files
+    are cut to find the cut offsets, and copies the ranges.
+    """
+    block_counts = count_newlines(fh)
+    lines = sum(block_counts) + (not ends_with_newline(fh, size))
+    quotient, remainder = divmod(lines, num_files)
+    part_lines = accumulate(quotient + (counter < remainder) for counter in range(num_files - 1))
+    cuts = [0] + line_ends(fh, block_counts, part_lines) + [size]
+    return write_ranges(fh, filename, cuts, size, workers)
+
+
+def split_bytes(fh, filename, size, num_files, workers=1):
+    """Splits a file into num_files files of about equal size, moving each
+    cut forward to the next line start, without a counting pass.
+    """
+    cuts = [next_line_start(fh, size * counter // num_files, size) for counter in range(num_files + 1)]
+    return write_ranges(fh, filename, cuts, size, workers)
+
+
+def split_size(fh, filename, size, max_bytes, workers=1):
+    """Splits a file into as many files as needed to hold at most max_bytes
+    each, cutting at the last line start that fits. A line longer than
+    max_bytes gets a file of its own.
+    """
+    cuts = [0]
+    while cuts[-1] < size:
+        start = cuts[-1]
+        if start + max_bytes >= size:
+            cut = size
+        else:
+            cut = previous_line_start(fh, start + max_bytes, start)
+            if cut is None:
+                cut = next_line_start(fh, start + max_bytes, size)
+        cuts.append(cut)
+    return write_ranges(fh, filename, cuts, size, workers)
+
+
+def split_round_robin(fh, filename, num_files):
+    """Deals the lines of a file out to num_files files in turn, so each
+    file gets an even share of every part of the input. Each block is
+    split into lines once and every file takes a slice of them.
+    """
+    outfiles = [open(output_name(filename, counter), 'wb', buffering=BLOCK_SIZE // num_files or 1)
+                for counter in range(1, num_files + 1)]
+    first, partial = 0, b''
+    fh.seek(0)
+    for block in iter(lambda: fh.read(ROUND_ROBIN_BLOCK_SIZE), b''):
+        lines = (partial + block).split(b'\n')
+        partial = lines.pop()
+        for counter, outfile in enumerate(outfiles):
+            share = lines[(counter - first) % num_files::num_files]
+            if share:
+                outfile.write(b'\n'.join(share) + b'\n')
+        first = (first + len(lines)) % num_files
+    if partial:
+        outfiles[first].write(partial + b'\n')
+    for outfile in outfiles:
+        outfile.close()
+    return num_files
+
+
+def parse_size(value):
+    """Converts a size such as 500, 64K, 100M or 2G to a number of bytes.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    value = value.strip().upper().rstrip('B')
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def main():
+    size = os.path.getsize(args.input_file)
+    with open(args.input_file, 'rb') as fh:
+        if args.size:
+            written = split_size(fh, args.input_file, size, args.size, args.workers)
+        elif args.lines:
+            written = write_lines(fh, args.input_file, repeat(args.lines))
+        elif args.round_robin:
+            written = split_round_robin(fh, args.input_file, args.num_files)
+        elif args.bytes:
+            written = split_bytes(fh, args.input_file, size, args.num_files, args.workers)
+        else:
+            written = split_lines(fh, args.input_file, size, args.num_files, args.workers)
+    print("[+] Split {} into {} files.".format(args.input_file, written))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument("input_file", help="the file to split")
+    parser.add_argument("num_files", nargs='?', type=int, help="the number of files to split the input file into")
+    parser.add_argument("-b", "--bytes", help="split num_files ways by size rather than by line count, which skips the counting pass", action="store_true")
+    parser.add_argument("-rr", "--round_robin", help="deal the lines out to num_files files in turn", action="store_true")
+    parser.add_argument("-s", "--size", type=parse_size, help="split into files of at most this size, such as 100M")
+    parser.add_argument("-l", "--lines", type=int, help="split into files of this many lines")
+    parser.add_argument("-w", "--workers", type=int, default=cpu_count(), help="number of files written at once when splitting by line count, -b or -s (default=number of cores)")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.input_file):
+        parser.print_help()
+        print("\n[-] The file cannot be found or you do not have permission to open the file. Please check the path and try again\n")
+        exit()
+
+    if bool(args.size) + bool(args.lines) + bool(args.num_files) != 1 or (args.num_files is not None and args.num_files < 1):
+        parser.print_help()
+        print("\n[-] Please specify either a number of files to split into, a size (-s) or a number of lines (-l).\n")
+        exit()
+
+    if (args.bytes or args.round_robin) and not args.num_files:
+        parser.print_help()
+        print("\n[-] The -b and -rr options need a number of files to split into.\n")
+        exit()
+
+    main()
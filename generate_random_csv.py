@@ -1,33 +1,508 @@
-import pandas as pd
+import argparse
+import ipaddress
+import json
+import os
+from collections import deque
+from itertools import accumulate
+from multiprocessing import Pool, cpu_count
+
 import numpy as np
-import sys
-
-
-if len(sys.argv) != 4:
-	print("\nUsage: python3 generate_random_csv <outfile_name> <number of columns> <number of rows>")
-	print("Example: python3 generate_random_csv out.csv 5 10000")
-	print("\nThe above example will create a csv files with 5 columns and 10000 rows\n")
-	exit()
-
-
-outfile = sys.argv[1]
-cols = int(sys.argv[2])	
-rows = int(sys.argv[3])
-	
-def generate_data(number_of_rows, number_of_columns):
-	df = pd.DataFrame(np.random.randint(0,100,size=(number_of_rows, number_of_columns)), columns=range(number_of_columns))
-	return df
-	
-	
-def write_to_csv(dataframe, filename):
-	dataframe.to_csv(filename, index=False)
-	
-	
+
+try:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+except ImportError:
+	pa = pq = None
+
+
+__description__ = '''Generates a file of random data, by default a csv file of random integers
+from 0 to 99 with a header row of column numbers. A schema (-sc) gives
+each column a type and distribution, and the data can be written as csv,
+Parquet, Feather or a NumPy .npy file. Rows are generated and written a
+block at a time, so files far larger than memory can be made. Example:
+generate_random_csv.py out.csv 5 10000 creates out.csv with 5 columns and
+10000 rows, and generate_random_csv.py conn.parquet 1000000 -sc conn
+creates a million rows shaped like a zeek conn.log.'''
+
+
+# Number of cells generated and formatted at a time
+BLOCK_CELLS = 4 * 1024 * 1024
+
+# Settings of each column type and their defaults. A column is a
+# dictionary holding a name, a type and any of these settings, and may
+# also hold a seed so it comes out the same whatever the other columns
+# are. Distributions are uniform (min to max), normal (mean, std),
+# exponential (scale) and zipf (a, shifted to start at min). An int
+# column of another distribution than uniform has no default min or max,
+# so its values are only clipped to the bounds the schema sets.
+COLUMN_DEFAULTS = {
+	'int': {'min': 0, 'max': 99, 'distribution': 'uniform', 'mean': 0.0, 'std': 1.0, 'scale': 1.0, 'a': 2.0},
+	'float': {'min': 0.0, 'max': 1.0, 'distribution': 'uniform', 'mean': 0.0, 'std': 1.0, 'scale': 1.0, 'decimals': 3},
+	'string': {'length': 8, 'min_length': None, 'alphabet': 'abcdefghijklmnopqrstuvwxyz0123456789'},
+	'category': {'values': ['a', 'b', 'c'], 'weights': None},
+	'timestamp': {'start': '2018-05-14T07:15:23', 'interval': 1.0},
+	'ip': {'network': '10.0.0.0/8', 'hosts': None},
+}
+
+# Characters that would need quoting in a csv file, which is written
+# without quoting, so they are refused in names, values and alphabets
+CSV_SPECIAL = ',"\r\n'
+
+FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.feather': 'feather', '.arrow': 'feather', '.npy': 'npy'}
+
+SCHEMAS = {
+	# The columns of a zeek conn.log as exported to csv, in the positions
+	# beacon_finder.py reads
+	'conn': [
+		{'name': 'ts', 'type': 'timestamp', 'interval': 0.01},
+		{'name': 'id.orig_h', 'type': 'ip', 'network': '192.168.1.0/24'},
+		{'name': 'id.orig_p', 'type': 'int', 'min': 1024, 'max': 65535},
+		{'name': 'id.resp_h', 'type': 'ip', 'network': '10.0.0.0/8', 'hosts': 500},
+		{'name': 'id.resp_p', 'type': 'category', 'values': ['443', '80', '53', '22', '445', '8080'], 'weights': [50, 20, 20, 4, 4, 2]},
+		{'name': 'proto', 'type': 'category', 'values': ['tcp', 'udp', 'icmp'], 'weights': [70, 25, 5]},
+		{'name': 'service', 'type': 'category', 'values': ['ssl', 'http', 'dns', 'ssh', '-'], 'weights': [45, 20, 20, 5, 10]},
+		{'name': 'duration', 'type': 'float', 'distribution': 'exponential', 'scale': 2.0, 'decimals': 6},
+		{'name': 'orig_bytes', 'type': 'int', 'distribution': 'zipf', 'a': 1.5, 'min': 0, 'max': 100000000},
+		{'name': 'resp_bytes', 'type': 'int', 'distribution': 'zipf', 'a': 1.3, 'min': 0, 'max': 1000000000},
+		{'name': 'conn_state', 'type': 'category', 'values': ['SF', 'S0', 'REJ', 'RSTO', 'SH'], 'weights': [80, 8, 6, 4, 2]},
+		{'name': 'missed_bytes', 'type': 'int', 'min': 0, 'max': 0},
+	],
+}
+
+
+def load_schema(schema, cols=None):
+	"""Returns the list of columns of a built in schema, of a json file
+	holding a list of columns, or of cols integer columns from 0 to 99 if
+	schema is None. Missing settings are filled in from COLUMN_DEFAULTS.
+	Raises ValueError if a column is not valid, if its name, category
+	values or string alphabet hold a character listed in CSV_SPECIAL, or
+	if a string alphabet is not ASCII.
+	"""
+	if schema is None:
+		columns = [{'name': str(index), 'type': 'int'} for index in range(cols)]
+	elif schema in SCHEMAS:
+		columns = SCHEMAS[schema]
+	else:
+		with open(schema) as fh:
+			columns = json.load(fh)
+	if not isinstance(columns, list) or not columns:
+		raise ValueError('a schema is a list of columns')
+	filled = []
+	for index, column in enumerate(columns):
+		if not isinstance(column, dict) or column.get('type') not in COLUMN_DEFAULTS:
+			raise ValueError('column {} needs a type, one of {}'.format(index + 1, ', '.join(COLUMN_DEFAULTS)))
+		defaults = COLUMN_DEFAULTS[column['type']]
+		if column['type'] == 'int' and column.get('distribution', 'uniform') != 'uniform':
+			defaults = dict(defaults, min=None, max=None)
+		filled.append(dict(defaults, name=str(index)))
+		filled[-1].update(column)
+	names = [column['name'] for column in filled]
+	if len(set(names)) != len(names):
+		raise ValueError('column names must be unique')
+	for column in filled:
+		if column['type'] == 'category':
+			column['values'] = [str(value) for value in column['values']]
+		texts = [str(column['name'])]
+		if column['type'] == 'category':
+			texts += column['values']
+		if column['type'] == 'string':
+			texts.append(column['alphabet'])
+		if any(char in text for text in texts for char in CSV_SPECIAL):
+			raise ValueError('column {} holds a comma, quote or line break, which csv files are written without quoting'.format(column['name']))
+		if column['type'] == 'string' and not column['alphabet'].isascii():
+			raise ValueError('the alphabet of column {} must be ASCII, as strings are drawn a byte at a time'.format(column['name']))
+		if column['type'] == 'ip':
+			column['network'] = ipaddress.IPv4Network(column['network'], strict=False)
+	return filled
+
+
+def block_sizes(rows, cols):
+	"""Returns the number of rows in each block of a file of rows rows.
+	"""
+	block_rows = max(1, BLOCK_CELLS // max(cols, 1))
+	return [min(block_rows, rows - start) for start in range(0, rows, block_rows)]
+
+
+def column_seed(column, index, seed):
+	"""Returns the seed of a column, which is its own seed if it has one
+	and otherwise the file's seed and the column's position. Shards add
+	their number to either.
+	"""
+	return (column['seed'], *seed[1:]) if 'seed' in column else (*seed, index)
+
+
+def random_numbers(column, rng, rows):
+	"""Draws rows numbers from the distribution of an int or float column.
+	"""
+	distribution = column['distribution']
+	if distribution == 'normal':
+		return rng.normal(column['mean'], column['std'], rows)
+	if distribution == 'exponential':
+		return rng.exponential(column['scale'], rows)
+	if distribution == 'zipf':
+		return rng.zipf(column['a'], rows) + ((column['min'] or 0) - 1)
+	if column['type'] == 'int':
+		return rng.integers(column['min'], column['max'], size=rows, endpoint=True)
+	return rng.uniform(column['min'], column['max'], rows)
+
+
+def int_bounds(column, dtype):
+	"""Returns the bounds an int column's values of the given dtype are
+	clipped to, its min and max with the int64 range standing in for the
+	ones not set. The float bounds stop short of 2 ** 63, which does not
+	fit an int64.
+	"""
+	low, high = column['min'], column['max']
+	if low is None:
+		low = np.iinfo(np.int64).min
+	if high is None:
+		high = np.iinfo(np.int64).max if dtype.kind != 'f' else np.nextafter(2.0 ** 63, 0)
+	return low, high
+
+
+def generate_column(column, seed, number, first_row, rows):
+	"""Generates the number'th block of a column, which starts at row
+	first_row of the file. Ints are int64, floats float64, strings byte
+	strings padded with zeros, categories indexes into the values,
+	timestamps int64 microseconds since the epoch and IP addresses
+	uint32.
+	"""
+	rng = np.random.default_rng([*seed, 1, number])
+	kind = column['type']
+	if kind == 'int':
+		numbers = random_numbers(column, rng, rows)
+		if numbers.dtype.kind == 'f':
+			numbers = np.rint(numbers)
+		return np.clip(numbers, *int_bounds(column, numbers.dtype)).astype(np.int64)
+	if kind == 'float':
+		return random_numbers(column, rng, rows)
+	if kind == 'string':
+		alphabet = np.frombuffer(column['alphabet'].encode(), dtype=np.uint8)
+		length = column['length']
+		chars = alphabet[rng.integers(0, len(alphabet), size=(rows, length))]
+		if column['min_length'] is not None:
+			lengths = rng.integers(column['min_length'], length, size=rows, endpoint=True)
+			chars[np.arange(length) >= lengths[:, None]] = 0
+		return chars.view('S{}'.format(length)).ravel()
+	if kind == 'category':
+		weights = column['weights']
+		if weights is None:
+			return rng.integers(0, len(column['values']), size=rows)
+		return rng.choice(len(column['values']), size=rows, p=np.asarray(weights) / sum(weights))
+	if kind == 'timestamp':
+		start = np.datetime64(column['start'], 'us').astype(np.int64) if isinstance(column['start'], str) else int(column['start'] * 1000000)
+		interval = column['interval'] * 1000000
+		offsets = (np.arange(first_row, first_row + rows) + rng.random(rows)) * interval
+		return start + offsets.astype(np.int64)
+	network = column['network']
+	if column['hosts']:
+		hosts = np.random.default_rng([*seed, 0]).integers(0, network.num_addresses, size=column['hosts'])
+		addresses = hosts[rng.integers(0, len(hosts), size=rows)]
+	else:
+		addresses = rng.integers(0, network.num_addresses, size=rows)
+	return (int(network.network_address) + addresses).astype(np.uint32)
+
+
+def generate_block(schema, seed, number, first_row, rows, output_format='csv'):
+	"""Generates the number'th block of a file, which starts at row
+	first_row. Runs in a worker process when there is more than one
+	worker. Each column of each block has its own generator seeded from
+	the column's seed and the block number, so the output is the same
+	however many workers make it. Returns the block formatted as csv
+	bytes, or a dictionary of its columns for the other formats.
+	"""
+	columns = {column['name']: generate_column(column, column_seed(column, index, seed), number, first_row, rows)
+			   for index, column in enumerate(schema)}
+	if output_format == 'csv':
+		return format_csv(schema, columns)
+	return columns
+
+
+def text_column(rows, character, used=True):
+	"""Returns a one character wide part of the text of rows values,
+	holding the same character in every row, in the form number_cells
+	returns.
+	"""
+	return [(np.broadcast_to(np.uint8(ord(character)), (rows, 1)), np.broadcast_to(np.asarray(used), (rows, 1)))]
+
+
+def number_cells(values, decimals=0):
+	"""Lays out integers as text, divided by 10 ** decimals, in one pass
+	with NumPy. Returns a list of parts, each a 2-D uint8 array with one
+	row of characters per value and a boolean array marking the
+	characters in use, so leading zeros and unused signs are left out.
+	The parts of a whole block are joined side by side once, and no
+	Python object is made per value.
+	"""
+	values = np.asarray(values, dtype=np.int64)
+	magnitude = np.abs(values)
+	width = max(len(str(int(magnitude.max()))) if len(values) else 1, decimals + 1)
+	whole = width - decimals
+	powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+	digits = (magnitude[:, None] // powers % 10 + 48).astype(np.uint8)
+	digits_keep = np.ones(digits.shape, dtype=bool)
+	digits_keep[:, :whole - 1] = magnitude[:, None] >= powers[:whole - 1]
+	parts = []
+	if len(values) and values.min() < 0:
+		parts += [(np.full((len(values), 1), ord('-'), dtype=np.uint8), (values < 0)[:, None])]
+	parts += [(digits[:, :whole], digits_keep[:, :whole])]
+	if decimals:
+		parts += text_column(len(values), '.') + [(digits[:, whole:], digits_keep[:, whole:])]
+	return parts
+
+
+def byte_cells(values):
+	"""Lays out an array of zero padded byte strings as text in the same
+	way as number_cells.
+	"""
+	cells = values.view(np.uint8).reshape(len(values), -1)
+	return [(cells, cells != 0)]
+
+
+def column_cells(column, values):
+	"""Lays out a block of a column as text in the same way as
+	number_cells. Timestamps are seconds since the epoch with six
+	decimals, as zeek writes them.
+	"""
+	kind = column['type']
+	if kind == 'int':
+		return number_cells(values)
+	if kind == 'float':
+		return number_cells(np.rint(values * 10 ** column['decimals']), column['decimals'])
+	if kind == 'string':
+		return byte_cells(values)
+	if kind == 'category':
+		return byte_cells(category_strings(column)[values])
+	if kind == 'timestamp':
+		return number_cells(values, 6)
+	parts = []
+	for shift in (24, 16, 8, 0):
+		if shift != 24:
+			parts += text_column(len(values), '.')
+		parts += number_cells(values >> shift & 255)
+	return parts
+
+
+def join_cells(parts):
+	"""Joins the parts of the text of a block side by side and returns
+	the characters in use, row after row, along with the number used in
+	each row.
+	"""
+	cells = np.hstack([part for part, used in parts])
+	keep = np.hstack([used for part, used in parts])
+	return cells[keep].tobytes(), keep.sum(axis=1)
+
+
+def category_strings(column):
+	"""Returns the values of a category column as byte strings.
+	"""
+	return np.array([value.encode('utf-8') for value in column['values']])
+
+
+def format_csv(schema, columns):
+	"""Formats a block of columns as csv rows. The text of every column
+	is laid out side by side with the separators, and the characters in
+	use are taken out in one go.
+	"""
+	rows = len(next(iter(columns.values())))
+	parts = []
+	for index, column in enumerate(schema):
+		parts += column_cells(column, columns[column['name']])
+		parts += text_column(rows, '\n' if index == len(schema) - 1 else ',')
+	return join_cells(parts)[0]
+
+
+def numpy_dtype(schema):
+	"""Returns the structured dtype of a .npy file of the schema.
+	"""
+	fields = []
+	for column in schema:
+		kind = column['type']
+		if kind == 'string':
+			fields.append((column['name'], 'S{}'.format(column['length'])))
+		elif kind == 'category':
+			fields.append((column['name'], category_strings(column).dtype))
+		else:
+			fields.append((column['name'], {'int': '<i8', 'float': '<f8', 'timestamp': '<M8[us]', 'ip': '<u4'}[kind]))
+	return np.dtype(fields)
+
+
+def numpy_column(column, values):
+	"""Converts a block of a column to the type it has in a .npy file.
+	Floats are rounded to the decimals written to a csv file.
+	"""
+	if column['type'] == 'category':
+		return category_strings(column)[values]
+	if column['type'] == 'timestamp':
+		return values.view('<M8[us]')
+	if column['type'] == 'float':
+		return np.round(values, column['decimals'])
+	return values
+
+
+def arrow_schema(schema):
+	"""Returns the Arrow schema of a Parquet or Feather file of the
+	schema. Categories are dictionary encoded and IP addresses are
+	strings.
+	"""
+	types = {
+		'int': pa.int64(),
+		'float': pa.float64(),
+		'string': pa.string(),
+		'category': pa.dictionary(pa.int32(), pa.string()),
+		'timestamp': pa.timestamp('us'),
+		'ip': pa.string(),
+	}
+	return pa.schema([(column['name'], types[column['type']]) for column in schema])
+
+
+def arrow_strings(parts):
+	"""Builds an Arrow string array straight from the text laid out by
+	column_cells, without making a Python string per value.
+	"""
+	data, lengths = join_cells(parts)
+	offsets = np.zeros(len(lengths) + 1, dtype=np.int32)
+	np.cumsum(lengths, out=offsets[1:])
+	return pa.StringArray.from_buffers(len(lengths), pa.py_buffer(offsets), pa.py_buffer(data))
+
+
+def arrow_column(column, values):
+	"""Converts a block of a column to an Arrow array. Floats are rounded
+	to the decimals written to a csv file.
+	"""
+	kind = column['type']
+	if kind == 'category':
+		return pa.DictionaryArray.from_arrays(pa.array(values.astype(np.int32)), pa.array(column['values'], pa.string()))
+	if kind == 'timestamp':
+		return pa.array(values, pa.timestamp('us'))
+	if kind in ('string', 'ip'):
+		return arrow_strings(column_cells(column, values))
+	if kind == 'float':
+		return pa.array(np.round(values, column['decimals']))
+	return pa.array(values)
+
+
+def iter_blocks(schema, seed, rows, first_row=0, output_format='csv', pool=None, workers=1):
+	"""Yields the blocks of a file in order. With a pool the blocks are
+	made by the worker processes, with at most two blocks per worker in
+	flight so memory stays bounded.
+	"""
+	sizes = block_sizes(rows, len(schema))
+	starts = accumulate([first_row] + sizes[:-1])
+	if pool is None:
+		for number, (start, size) in enumerate(zip(starts, sizes)):
+			yield generate_block(schema, seed, number, start, size, output_format)
+		return
+	pending = deque()
+	for number, (start, size) in enumerate(zip(starts, sizes)):
+		pending.append(pool.apply_async(generate_block, (schema, seed, number, start, size, output_format)))
+		while len(pending) >= workers * 2:
+			yield pending.popleft().get()
+	for result in pending:
+		yield result.get()
+
+
+def write_file(filename, schema, rows, seed, first_row=0, output_format='csv', pool=None, workers=1):
+	"""Writes a file of rows rows of random data in the given format. A
+	csv file starts with a header row of the column names. A .npy file
+	holds one structured array, so it can be opened with
+	numpy.load(filename, mmap_mode='r') without reading it. A Parquet file
+	gets a row group per block and a Feather file a record batch per
+	block.
+	"""
+	blocks = iter_blocks(schema, seed, rows, first_row, output_format, pool, workers)
+	if output_format == 'csv':
+		with open(filename, 'wb') as fh:
+			fh.write(','.join(column['name'] for column in schema).encode() + b'\n')
+			for block in blocks:
+				fh.write(block)
+	elif output_format == 'npy':
+		array = np.lib.format.open_memmap(filename, mode='w+', dtype=numpy_dtype(schema), shape=(rows,))
+		start = 0
+		for block in blocks:
+			size = len(next(iter(block.values())))
+			for column in schema:
+				array[column['name']][start:start + size] = numpy_column(column, block[column['name']])
+			start += size
+		array.flush()
+		del array
+	else:
+		table_schema = arrow_schema(schema)
+		writer = pq.ParquetWriter(filename, table_schema) if output_format == 'parquet' else pa.ipc.new_file(filename, table_schema)
+		try:
+			for block in blocks:
+				arrays = [arrow_column(column, block[column['name']]) for column in schema]
+				batch = pa.RecordBatch.from_arrays(arrays, schema=table_schema)
+				if output_format == 'parquet':
+					writer.write_table(pa.Table.from_batches([batch]))
+				else:
+					writer.write_batch(batch)
+		finally:
+			writer.close()
+
+
+def shard_name(filename, counter):
+	"""Returns the name of the counter'th shard of filename.
+	"""
+	directory, basename = os.path.split(filename)
+	return os.path.join(directory, str(counter) + "_" + basename)
+
+
 def main():
-	df = generate_data(rows, cols)
-	write_to_csv(df, outfile)
-	print("{} has been created with {} rows and {} columns".format(outfile, rows, cols))
-	
-	
+	seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+	if args.shards > 1:
+		quotient, remainder = divmod(args.rows, args.shards)
+		sizes = [quotient + (counter <= remainder) for counter in range(1, args.shards + 1)]
+		shards = [(shard_name(args.outfile, counter), schema, size, (seed, counter), sum(sizes[:counter - 1]), args.format)
+				  for counter, size in enumerate(sizes, 1)]
+		if args.workers > 1:
+			with Pool(min(args.workers, args.shards)) as pool:
+				pool.starmap(write_file, shards)
+		else:
+			for shard in shards:
+				write_file(*shard)
+		print("{} shards of {} have been created with {} rows and {} columns".format(args.shards, args.outfile, args.rows, len(schema)))
+		return
+	if args.workers > 1:
+		with Pool(args.workers) as pool:
+			write_file(args.outfile, schema, args.rows, (seed,), 0, args.format, pool, args.workers)
+	else:
+		write_file(args.outfile, schema, args.rows, (seed,), 0, args.format)
+	print("{} has been created with {} rows and {} columns".format(args.outfile, args.rows, len(schema)))
+
+
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	parser = argparse.ArgumentParser(description=__description__)
+	parser.add_argument("outfile", help="the file to create")
+	parser.add_argument("cols", type=int, help="number of columns, left out when a schema gives the columns")
+	parser.add_argument("rows", type=int, nargs='?', help="number of rows")
+	parser.add_argument("-sc", "--schema", help="a json file holding a list of columns, or the name of a built in schema ({})".format(', '.join(SCHEMAS)))
+	parser.add_argument("-f", "--format", choices=sorted(set(FORMATS.values())), help="output format (default=from the outfile extension, otherwise csv)")
+	parser.add_argument("-s", "--shards", type=int, default=1, help="split the rows across this many files, 1_outfile to N_outfile, each with its own header (default=1)")
+	parser.add_argument("-w", "--workers", type=int, default=cpu_count(), help="number of processes generating rows (default=number of cores)")
+	parser.add_argument("-sd", "--seed", type=int, help="seed for the random numbers, so the same file can be made again")
+	args = parser.parse_args()
+
+	if args.schema and args.rows is None:
+		args.cols, args.rows = None, args.cols
+
+	if args.rows is None or args.rows < 0 or args.shards < 1 or (not args.schema and args.cols < 1):
+		parser.print_help()
+		print("\n[-] Please specify at least one column or a schema, a number of rows and at least one shard.\n")
+		exit()
+
+	try:
+		schema = load_schema(args.schema, args.cols)
+	except (OSError, ValueError) as e:
+		print("[-] Could not load the schema: {}".format(e))
+		exit()
+
+	if args.format is None:
+		args.format = FORMATS.get(os.path.splitext(args.outfile)[1].lower(), 'csv')
+
+	if args.format in ('parquet', 'feather') and pa is None:
+		print('[-] Missing module: pyarrow')
+		print('[-] Try running "pip install pyarrow", or do an Internet search for installation instructions.')
+		exit()
+
+	main()
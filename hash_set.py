@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+__author__ = 'Jake Miller (@LaconicWolf)'
+__date__ = '20171013'
+__version__ = '0.01'
+__description__ = """Compact set of 64-bit hashes shared by password_trimmer.py and
+mangle_forced_browse_wordlist.py"""
+
+
+import numpy as np
+
+
+# Number of hashes added back at a time when the table grows, bounding
+# the scratch arrays of each probe step
+GROW_PIECE = 1 << 20
+
+
+class HashSet:
+    """A set of 64-bit hashes kept in one NumPy array with open addressing
+    and linear probing, at 8 bytes a slot and at most half full. Whole
+    arrays of hashes are added at once, a probe step at a time.
+    """
+
+    def __init__(self, capacity=1 << 20):
+        self.table = np.zeros(capacity, dtype=np.uint64)
+        self.count = 0
+
+    def add(self, hashes):
+        """Adds an array of hashes and returns a boolean array marking the
+        ones that were not in the set. Of equal hashes in the array only
+        the first is marked. Zero marks an empty slot, so a hash of zero
+        is stored as one.
+        """
+        while (self.count + len(hashes)) * 2 > len(self.table):
+            self.grow()
+        hashes = np.where(hashes == 0, np.uint64(1), hashes)
+        new = np.zeros(len(hashes), dtype=bool)
+        mask = np.uint64(len(self.table) - 1)
+        pending = np.arange(len(hashes))
+        slots = hashes & mask
+        while len(pending):
+            current = self.table[slots]
+            found = current == hashes[pending]
+            empty = current == 0
+            # Of the hashes probing the same empty slot the first takes it;
+            # the rest look at the same slot again, where an equal hash will
+            # now be found
+            taken_slots, first = np.unique(slots[empty], return_index=True)
+            winners = np.flatnonzero(empty)[first]
+            self.table[taken_slots] = hashes[pending[winners]]
+            new[pending[winners]] = True
+            self.count += len(winners)
+            retry = ~found
+            retry[winners] = False
+            advance = ~found & ~empty
+            slots = np.where(advance, (slots + np.uint64(1)) & mask, slots)[retry]
+            pending = pending[retry]
+        return new
+
+    def grow(self):
+        """Doubles the size of the table and adds the hashes back in,
+        GROW_PIECE at a time.
+        """
+        stored = self.table[self.table != 0]
+        self.table = np.zeros(len(self.table) * 2, dtype=np.uint64)
+        self.count = 0
+        for start in range(0, len(stored), GROW_PIECE):
+            self.add(stored[start:start + GROW_PIECE])
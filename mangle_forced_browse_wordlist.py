@@ -1,17 +1,32 @@
 #!/usr/bin/env python
 
+import argparse
+import re
 import sys
+from collections import deque
+from itertools import chain, islice, product
+from multiprocessing import Pool
 
-if len(sys.argv) < 2 or len(sys.argv) > 3:
-    print("Usage: python {} wordlist_to_mangle [outfile_name]".format(sys.argv[0]))
-    exit()
+import numpy as np
 
-infile = sys.argv[1]
+from hash_set import HashSet
 
-if len(sys.argv) == 3:
-    outfile = sys.argv[2]
-else:
-    outfile = None
+
+__description__ = '''Mangles a forced browse wordlist by swapping trigger words in each entry
+for related words, so /user/add also yields /user/edit, /role/add and so
+on. With -c every combination of replacements of the triggers in an
+entry is made, so /user/add also yields /role/edit. Writes the mangled
+words to stdout or to an output file.'''
+
+
+# Number of characters of mangled words gathered before each write
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Number of words handed to a worker process at a time
+WORDS_PER_BATCH = 10000
+
+# Number of bit positions each word sets in the Bloom filter
+BLOOM_HASHES = 7
 
 word_dict = {
     'add': ['edit', 'delete', 'replace'],
@@ -22,26 +37,231 @@ word_dict = {
     'role': ['user'],
 }
 
-trigger_words = [
-    'add',
-    'edit',
-    'delete',
-    'replace',
-    'user',
-    'role'
-]
-
-with open(infile) as fh:
-    wordlist = fh.read().splitlines()
-
-new_wordlist = []
-
-for trigger_word in trigger_words:
-    for word in wordlist:
-        if trigger_word in word:
-            replacement_words = word_dict.get(trigger_word)
-            for replacement_word in replacement_words:
-                new_wordlist.append(word.replace(trigger_word, replacement_word))
-
-for new_word in new_wordlist:
-    print(new_word)
\ No newline at end of file
+
+def read_rules(filename):
+    """Reads mangling rules from a file, one trigger per line followed by a
+    colon and its replacements separated by commas, such as
+    add: edit, delete. Blank lines and lines starting with # are skipped.
+    Returns a dictionary in the order of the file.
+    """
+    rules = {}
+    with open(filename, encoding='utf-8') as fh:
+        for number, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            trigger, separator, replacements = line.partition(':')
+            if not separator or not trigger.strip():
+                raise ValueError('line {} of {} is not trigger: replacement, ...'.format(number, filename))
+            rules.setdefault(trigger.strip(), []).extend(
+                word.strip() for word in replacements.split(',') if word.strip())
+    return rules
+
+
+def compile_rules(rules):
+    """Compiles the triggers of the rules into one pattern that finds
+    them all in a single pass over a word. The pattern matches in a
+    lookahead, trying longer triggers first, so it reports the longest
+    trigger starting at each position. Every trigger that is a prefix of
+    a reported one starts there too, so a map from each trigger to the
+    triggers it starts with is returned along with the pattern.
+    """
+    triggers = sorted(rules, key=len, reverse=True)
+    pattern = re.compile('(?=(' + '|'.join(map(re.escape, triggers)) + '))')
+    prefixes = {trigger: [other for other in rules if trigger.startswith(other)] for trigger in rules}
+    return pattern, prefixes
+
+
+def compile_combined(rules):
+    """Compiles the triggers of the rules into a pattern whose split of a
+    word alternates between the text around the triggers and the
+    triggers themselves, longer triggers taking precedence.
+    """
+    triggers = sorted(rules, key=len, reverse=True)
+    return re.compile('(' + '|'.join(map(re.escape, triggers)) + ')')
+
+
+def read_words(fh):
+    """Yields the words of a wordlist one at a time without their line
+    endings.
+    """
+    for line in fh:
+        yield line.rstrip('\r\n')
+
+
+def find_triggers(word, matcher):
+    """Returns the set of triggers that occur in a word.
+    """
+    pattern, prefixes = matcher
+    found = set()
+    for trigger in set(pattern.findall(word)):
+        found.update(prefixes[trigger])
+    return found
+
+
+def mangle_word(word, rules, matcher):
+    """Returns the mangles of one word: for each trigger in the word and
+    each of its replacements, the word with every occurrence of the
+    trigger replaced.
+    """
+    found = find_triggers(word, matcher)
+    return [word.replace(trigger, replacement)
+            for trigger, replacements in rules.items() if trigger in found
+            for replacement in replacements]
+
+
+def mangle_combined(word, rules, pattern, max_expansions=None):
+    """Returns every combination of replacements of the trigger
+    occurrences in a word, each occurrence either kept or replaced on its
+    own, leaving out the word itself. At most max_expansions are made;
+    the combinations are generated lazily, so a word with many triggers
+    costs no more than the cap.
+    """
+    parts = pattern.split(word)
+    if len(parts) == 1:
+        return []
+    choices = [(part, *rules[part]) if index % 2 else (part,) for index, part in enumerate(parts)]
+    stop = None if max_expansions is None else max_expansions + 1
+    return [''.join(combination) for combination in islice(product(*choices), 1, stop)]
+
+
+def mangle_batch(words, rules, combine=False, max_expansions=None):
+    """Returns the mangles of a list of words in order. Runs in a worker
+    process when there is more than one worker.
+    """
+    mangled = []
+    if combine:
+        pattern = compile_combined(rules)
+        for word in words:
+            mangled.extend(mangle_combined(word, rules, pattern, max_expansions))
+    else:
+        matcher = compile_rules(rules)
+        for word in words:
+            mangled.extend(mangle_word(word, rules, matcher))
+    return mangled
+
+
+def mangle_words(words, rules, combine=False, max_expansions=None, workers=1):
+    """Yields the mangles of a stream of words a batch at a time, in the
+    order of the words. With more than one worker the batches are mangled
+    by a pool of processes, with at most two batches per worker in flight
+    so memory stays bounded.
+    """
+    batches = iter(lambda: list(islice(words, WORDS_PER_BATCH)), [])
+    if workers <= 1:
+        for batch in batches:
+            yield mangle_batch(batch, rules, combine, max_expansions)
+        return
+    with Pool(workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(mangle_batch, (batch, rules, combine, max_expansions)))
+            while len(pending) >= workers * 2:
+                yield pending.popleft().get()
+        for result in pending:
+            yield result.get()
+
+
+class BloomFilter:
+    """A Bloom filter of a fixed number of bytes, rounded down to a power
+    of two. Each word sets BLOOM_HASHES bits picked by double hashing of
+    its 64-bit hash.
+    Words are never reported as new twice, but a small share of new words
+    is reported as seen once the filter fills, so memory stays fixed
+    however many words pass through.
+    """
+
+    def __init__(self, size):
+        self.bits = np.zeros(1 << max(size, 1).bit_length() - 1, dtype=np.uint8)
+        self.mask = np.uint64(len(self.bits) * 8 - 1)
+        self.steps = np.arange(BLOOM_HASHES, dtype=np.uint64)
+
+    def add(self, hashes):
+        """Adds an array of distinct 64-bit hashes and returns a boolean
+        array marking the ones that were not in the filter.
+        """
+        hashes = hashes[:, None]
+        steps = (hashes * np.uint64(0x9E3779B97F4A7C15)) ^ (hashes >> np.uint64(31)) | np.uint64(1)
+        positions = (hashes + self.steps * steps) & self.mask
+        offsets = positions >> np.uint64(3)
+        bits = np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        new = ((self.bits[offsets] & bits) == 0).any(axis=1)
+        np.bitwise_or.at(self.bits, offsets[new].ravel(), bits[new].ravel())
+        return new
+
+
+def unique_words(batches, method='hash', bloom_size=64 * 1024 * 1024):
+    """Yields each batch of words without the words already yielded,
+    comparing the words by Python's 64-bit string hash, which holds for
+    the whole run because it is only taken in this process. Two distinct
+    words with the same hash count as one, so either method may drop a
+    unique word: about one pair collides in 40 for a billion distinct
+    words. The hash method keeps the hashes in a HashSet, 16 to 32 bytes
+    a distinct word, so its memory grows with the output. The bloom
+    method keeps them in a bloom_size byte Bloom filter, which never
+    grows but drops more words as it fills.
+    """
+    seen = HashSet() if method != 'bloom' else None
+    bloom = BloomFilter(bloom_size) if method == 'bloom' else None
+    for batch in batches:
+        keys = np.fromiter(map(hash, batch), dtype=np.int64, count=len(batch)).view(np.uint64)
+        if seen is not None:
+            new = np.flatnonzero(seen.add(keys))
+        else:
+            first = np.sort(np.unique(keys, return_index=True)[1])
+            new = first[bloom.add(keys[first])]
+        yield [batch[index] for index in new.tolist()]
+
+
+def write_words(words, fh, buffer_size=WRITE_BUFFER_SIZE):
+    """Writes a stream of words to a binary file a line each, gathering
+    about buffer_size characters before each write. Returns the number of
+    words written.
+    """
+    buffered, size, count = [], 0, 0
+    for word in words:
+        buffered.append(word)
+        size += len(word) + 1
+        if size >= buffer_size:
+            fh.write(('\n'.join(buffered) + '\n').encode('utf-8', errors='surrogateescape'))
+            count += len(buffered)
+            buffered, size = [], 0
+    if buffered:
+        fh.write(('\n'.join(buffered) + '\n').encode('utf-8', errors='surrogateescape'))
+        count += len(buffered)
+    fh.flush()
+    return count
+
+
+def main():
+    with open(args.wordlist, encoding='utf-8', errors='surrogateescape') as infile:
+        mangled = mangle_words(read_words(infile), rules, args.combine, args.max_expansions or None, args.workers)
+        if args.unique:
+            mangled = unique_words(mangled, args.unique, args.bloom_size * 1024 * 1024)
+        mangled = chain.from_iterable(mangled)
+        if args.outfile:
+            with open(args.outfile, 'wb') as outfile:
+                write_words(mangled, outfile)
+        else:
+            write_words(mangled, sys.stdout.buffer)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument("wordlist", help="the wordlist to mangle")
+    parser.add_argument("outfile", nargs='?', help="file to write the mangled words to instead of stdout")
+    parser.add_argument("-r", "--rules", help="file of mangling rules, one 'trigger: replacement, replacement' per line, to use instead of the built in rules")
+    parser.add_argument("-c", "--combine", help="make every combination of replacements of the trigger occurrences in each word", action="store_true")
+    parser.add_argument("-m", "--max_expansions", type=int, default=1000, help="most combinations made from one word with -c, 0 for no limit (default=1000)")
+    parser.add_argument("-u", "--unique", nargs='?', const='hash', choices=['hash', 'bloom'], help="drop repeated mangles, remembering a 64-bit hash of every distinct mangle in a compact table (hash, the default) or using a fixed size Bloom filter that may drop a few unique mangles (bloom)")
+    parser.add_argument("-bs", "--bloom_size", type=int, default=64, help="size of the Bloom filter in MB (default=64)")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of processes mangling words (default=1)")
+    args = parser.parse_args()
+
+    try:
+        rules = read_rules(args.rules) if args.rules else word_dict
+    except (OSError, ValueError) as e:
+        print("[-] Could not read the rules: {}".format(e))
+        exit()
+
+    main()
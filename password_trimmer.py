@@ -1,44 +1,404 @@
-import sys
+import argparse
+import heapq
+import os
 import re
+import tempfile
+from collections import deque
+from functools import lru_cache
+from itertools import groupby
+from multiprocessing import Pool
 from pathlib import Path
 
+import numpy as np
+
+from hash_set import HashSet
+
 __author__ = 'Jake Miller'
 __date__ = '20171013'
-__version__ = '0.01'
+__version__ = '0.02'
 __description__ = 'Trims a password list to meet certain criteria'
 
-if len(sys.argv) != 2:
-    print('Usage: ./password_trimmer.py [filename]')
-    print('Output will be written to trimmed_[filename]')
-    exit()
 
-infile = sys.argv[1]
-outfile = 'trimmed_' + infile 
+# Number of bytes of the list read at a time, and the size of the byte
+# ranges handed to each worker
+BLOCK_SIZE = 4 * 1024 * 1024
+RANGE_SIZE = 16 * 1024 * 1024
 
-if not Path(infile).is_file():
-    print('The file {} could not be found. Please try again'.format(infile))
-    exit()
+# Number of bytes of kept lines hashed at a time when removing duplicates
+# with a hash set, and sorted at a time into each run of the external sort
+HASH_PIECE_SIZE = 1024 * 1024
+SORT_RUN_SIZE = 16 * 1024 * 1024
 
-trimmed_list = []
+# Regular expressions for the character classes a policy can require,
+# the first character of a word and the characters a word may contain.
+# The alpha first character also accepts numeric letters such as ² in the
+# regular expression, so lines that fall back to it check str.isalpha
+# as well, as the old trimmer did
+CHARACTER_CLASSES = {
+    'upper': r'[A-Z]',
+    'lower': r'[a-z]',
+    'digit': r'[0-9]',
+    'special': r'(?:[^\w\s]|_)',
+}
+FIRST_CHARACTERS = {
+    'alpha': r'[^\W\d_]',
+    'upper': r'[A-Z]',
+    'lower': r'[a-z]',
+    'digit': r'[0-9]',
+    'any': None,
+}
+CHARSETS = {
+    'word': r'\w',
+    'alnum': r'[^\W_]',
+    'printable': r'[!-~]',
+    'digits': r'[0-9]',
+    'any': r'\S',
+}
 
-with open(infile) as file:
-    for line in file:
-        if re.search(r'\W', line.strip()):
-            continue
-        if not len(line.strip()) == 8:  
-            continue
-        if not line[0].isalpha():
-            continue
-        if not re.search(r'[A-Z]', line.strip()):
-            continue
-        if not re.search(r'[a-z]', line.strip()):
-            continue
-        if not re.search(r'[0-9]', line.strip()):
+# Named policies selectable with -p. Options given on the command line
+# override the preset's
+PRESETS = {
+    'legacy': {'min_length': 8, 'max_length': 8, 'require': ['upper', 'lower', 'digit'],
+               'first_char': 'alpha', 'charset': 'word'},
+    'complex': {'min_length': 8, 'max_length': 0, 'require': ['upper', 'lower', 'digit', 'special'],
+                'first_char': 'any', 'charset': 'printable'},
+    'alnum': {'min_length': 8, 'max_length': 0, 'require': ['upper', 'lower', 'digit'],
+              'first_char': 'any', 'charset': 'alnum'},
+    'long': {'min_length': 12, 'max_length': 0, 'require': [], 'first_char': 'any', 'charset': 'printable'},
+    'pin': {'min_length': 4, 'max_length': 8, 'require': [], 'first_char': 'any', 'charset': 'digits'},
+}
+
+# Bits of the per byte flags. The low bits mark the required classes a
+# byte belongs to, one bit each
+DISALLOWED = 64
+FALLBACK = 128
+
+# Odd multiplier of the polynomial line hash
+HASH_BASE = np.uint64(0x9E3779B97F4A7C15)
+
+
+def policy_regex(min_length=8, max_length=8, required=('upper', 'lower', 'digit'), first_char='alpha',
+                 charset='word'):
+    """Returns the source of a regular expression that fully matches a
+    line meeting a password policy. The required character classes are
+    checked in lookaheads and the length and charset in one bounded
+    repeat. Trailing whitespace is allowed, as the old trimmer stripped it
+    before checking.
+    """
+    regex = ''.join('(?=.*?{})'.format(CHARACTER_CLASSES[name]) for name in required)
+    if FIRST_CHARACTERS[first_char]:
+        regex += '(?={})'.format(FIRST_CHARACTERS[first_char])
+    regex += '{}{{{},{}}}'.format(CHARSETS[charset], min_length, max_length if max_length else '')
+    return regex + r'[^\S\n]*'
+
+
+@lru_cache(maxsize=None)
+def compile_policy(policy):
+    """Compiles a policy, a tuple of the arguments of policy_regex, into
+    lookup tables for a single scan over the bytes of many words at once.
+    Each ASCII byte gets a flag with one bit per required class it
+    belongs to, plus DISALLOWED if it is outside the charset. Whitespace
+    and non-ASCII bytes get FALLBACK, sending their line to the regular
+    expression, which handles stripping and Unicode the way the old
+    trimmer did. The tables are built from the same regular expressions,
+    so both paths agree. Cached, so each worker compiles a policy once.
+    """
+    min_length, max_length, required, first_char, charset = policy
+    flags = np.zeros(256, dtype=np.uint8)
+    first = np.zeros(256, dtype=bool)
+    for code in range(256):
+        char = chr(code)
+        if code >= 128 or re.fullmatch(r'\s', char):
+            flags[code] = FALLBACK
             continue
-        trimmed_list.append(line)
+        for bit, name in enumerate(required):
+            if re.fullmatch(CHARACTER_CLASSES[name], char):
+                flags[code] |= 1 << bit
+        if not re.fullmatch(CHARSETS[charset], char):
+            flags[code] |= DISALLOWED
+        first[code] = not FIRST_CHARACTERS[first_char] or bool(re.fullmatch(FIRST_CHARACTERS[first_char], char))
+    flags[ord('\n')] = 0
+    first[ord('\n')] = first[ord('\r')] = not FIRST_CHARACTERS[first_char]
+    pattern = re.compile(policy_regex(*policy))
+    required_mask = (1 << len(required)) - 1
+    ascii_mask = sum(1 << bit for bit, name in enumerate(required) if name != 'special')
+    return pattern, flags, first, required_mask, ascii_mask
+
+
+def trim_block(block, policy):
+    """Returns the lines of a block of bytes that meet the policy, joined
+    into one block, and how many there are.
+
+    Every byte is looked up in the policy's flag table once, and the flags
+    of each line are ORed together, so checking the classes, charset and
+    length of every word takes a few array operations. Windows line
+    endings are allowed and written as newlines, as the old trimmer's
+    text mode did, and a last line without a newline is given one.
+    Lines holding other whitespace or non-ASCII bytes are matched with
+    the policy's regular expression instead, decoded with surrogateescape
+    so bytes that are not UTF-8 pass through unchanged, unless their
+    ASCII bytes already rule them out.
+    """
+    min_length, max_length, first_char = policy[0], policy[1], policy[3]
+    pattern, flags, first, required_mask, ascii_mask = compile_policy(policy)
+    if not block.endswith(b'\n'):
+        block += b'\n'
+    data = np.frombuffer(block, dtype=np.uint8)
+    newlines = np.flatnonzero(data == 10)
+    starts = np.r_[0, newlines[:-1] + 1]
+    ends = newlines - ((newlines > starts) & (data[newlines - 1] == 13))
+    byte_flags = flags[data]
+    byte_flags[ends] = 0
+    line_flags = np.bitwise_or.reduceat(byte_flags, starts)
+    lengths = ends - starts
+    keep = (lengths >= min_length) & first[data[starts]]
+    if max_length:
+        keep &= lengths <= max_length
+    keep &= (line_flags & (required_mask | DISALLOWED | FALLBACK)) == required_mask
+    fallback = (line_flags & (ascii_mask | DISALLOWED | FALLBACK)) == (ascii_mask | FALLBACK)
+    fallback &= first[data[starts]] | (flags[data[starts]] == FALLBACK)
+    for line in np.flatnonzero(fallback).tolist():
+        text = block[starts[line]:newlines[line]].decode('utf-8', errors='surrogateescape')
+        keep[line] = pattern.fullmatch(text) is not None and (first_char != 'alpha' or text[:1].isalpha())
+    kept = np.repeat(keep, newlines - starts + 1)
+    kept[newlines[ends < newlines] - 1] = False
+    return data[kept].tobytes(), int(keep.sum())
+
+
+def trim_range(filename, start, end, policy):
+    """Runs in a worker. Trims the lines of a file that start in the byte
+    range from start up to end, reading BLOCK_SIZE bytes at a time and
+    carrying any partial line over to the next block.
+    """
+    output, count, partial = [], 0, b''
+    with open(filename, 'rb') as fh:
+        fh.seek(start)
+        while start < end:
+            block = fh.read(min(BLOCK_SIZE, end - start))
+            if not block:
+                break
+            start += len(block)
+            cut = block.rfind(b'\n') + 1
+            if not cut:
+                partial += block
+                continue
+            kept, kept_count = trim_block(partial + block[:cut], policy)
+            output.append(kept)
+            count += kept_count
+            partial = block[cut:]
+    if partial:
+        kept, kept_count = trim_block(partial, policy)
+        output.append(kept)
+        count += kept_count
+    return b''.join(output), count
+
+
+def line_ranges(filename, range_size=RANGE_SIZE):
+    """Splits a file into byte ranges of about range_size bytes that each
+    end just after a newline, so no line is split between two ranges.
+    """
+    size = os.path.getsize(filename)
+    ranges, start = [], 0
+    with open(filename, 'rb') as fh:
+        while start < size:
+            end = start + range_size
+            if end < size:
+                fh.seek(end - 1)
+                while True:
+                    block = fh.read(65536)
+                    found = block.find(b'\n')
+                    if found != -1 or not block:
+                        end = end + found if found != -1 else size
+                        break
+                    end += len(block)
+            ranges.append((start, min(end, size)))
+            start = ranges[-1][1]
+    return ranges
+
+
+def iter_trimmed(infile, policy, workers=1):
+    """Yields the trimmed lines of infile a range at a time, in file
+    order. With more than one worker the ranges are trimmed by a pool of
+    processes, with at most two ranges per worker in flight so memory
+    stays bounded.
+    """
+    ranges = line_ranges(infile)
+    if workers <= 1:
+        for start, end in ranges:
+            yield trim_range(infile, start, end, policy)[0]
+        return
+    with Pool(workers) as pool:
+        pending = deque()
+        for start, end in ranges:
+            pending.append(pool.apply_async(trim_range, (infile, start, end, policy)))
+            while len(pending) >= workers * 2:
+                yield pending.popleft().get()[0]
+        for result in pending:
+            yield result.get()[0]
+
+
+@lru_cache(maxsize=None)
+def hash_powers(length):
+    """Returns the first length powers of HASH_BASE, wrapping at 64 bits.
+    """
+    powers = np.full(length, HASH_BASE, dtype=np.uint64)
+    powers[0] = 1
+    return np.cumprod(powers, dtype=np.uint64)
+
+
+def hash_lines(block):
+    """Returns a 64-bit hash of every line of a block of bytes that ends
+    in a newline, along with the length of each line including the
+    newline. The bytes of each line are weighted by powers of HASH_BASE
+    and summed with NumPy, and the sums are mixed with the splitmix64
+    finalizer, so no Python object is made per line.
+    """
+    data = np.frombuffer(block, dtype=np.uint8)
+    newlines = np.flatnonzero(data == 10)
+    if not len(newlines):
+        return np.zeros(0, dtype=np.uint64), newlines
+    starts = np.r_[0, newlines[:-1] + 1]
+    lengths = newlines - starts + 1
+    positions = np.arange(len(data)) - np.repeat(starts, lengths)
+    powers = hash_powers(1 << int(positions.max()).bit_length())
+    with np.errstate(over='ignore'):
+        hashes = np.add.reduceat((data.astype(np.uint64) + np.uint64(1)) * powers[positions], starts)
+        hashes ^= lengths.astype(np.uint64)
+        hashes ^= hashes >> np.uint64(30)
+        hashes *= np.uint64(0xBF58476D1CE4E5B9)
+        hashes ^= hashes >> np.uint64(27)
+        hashes *= np.uint64(0x94D049BB133111EB)
+        hashes ^= hashes >> np.uint64(31)
+    return hashes, lengths
+
+
+def iter_pieces(block, size):
+    """Splits a block of lines into pieces of about size bytes that end in
+    a newline.
+    """
+    start = 0
+    while start < len(block):
+        end = block.rfind(b'\n', start, start + size) + 1
+        if end <= start:
+            end = block.find(b'\n', start + size) + 1 or len(block)
+        yield block[start:end]
+        start = end
+
+
+def hash_unique(blocks, seen=None):
+    """Yields the lines of blocks that have not been seen before, in their
+    order, keeping only a 64-bit hash of each distinct line. Two distinct
+    lines whose hashes collide are taken as one, which for a billion
+    distinct lines happens to about one pair in 40.
+    """
+    seen = seen or HashSet()
+    for block in blocks:
+        for piece in iter_pieces(block, HASH_PIECE_SIZE):
+            hashes, lengths = hash_lines(piece)
+            new = seen.add(hashes)
+            yield np.frombuffer(piece, dtype=np.uint8)[np.repeat(new, lengths)].tobytes()
+
+
+def sort_unique(blocks, fh, run_size=SORT_RUN_SIZE):
+    """Writes the distinct lines of blocks to fh in sorted order, for
+    lists too large to keep even a hash of each line in memory. Runs of
+    about run_size bytes are sorted in memory and written to temporary
+    files next to the output, then merged. Returns the number of lines
+    written.
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(fh.name))) as run_dir:
+        runs, buffered, size = [], [], 0
+        for block in blocks:
+            buffered.append(block)
+            size += len(block)
+            if size >= run_size:
+                runs.append(write_run(run_dir, len(runs), buffered))
+                buffered, size = [], 0
+        if buffered:
+            runs.append(write_run(run_dir, len(runs), buffered))
+        run_files = [open(run, 'rb') for run in runs]
+        count = 0
+        for line, duplicates in groupby(heapq.merge(*run_files)):
+            fh.write(line)
+            count += 1
+        for run_file in run_files:
+            run_file.close()
+    return count
+
+
+def write_run(run_dir, number, blocks):
+    """Sorts the lines of some blocks and writes each distinct line to a
+    run file for sort_unique. Returns the name of the file.
+    """
+    lines = b''.join(blocks).split(b'\n')
+    lines.pop()
+    lines.sort()
+    filename = os.path.join(run_dir, '{}.run'.format(number))
+    with open(filename, 'wb') as fh:
+        fh.write(b''.join(line + b'\n' for line, duplicates in groupby(lines)))
+    return filename
+
+
+def trim_file(infile, outfile, policy, workers=1, unique=None):
+    """Streams the trimmed lines of infile to outfile. With unique set to
+    'hash' duplicates are dropped as they go past, keeping the order;
+    with 'sort' the distinct lines are written in sorted order using
+    files on disk. Returns the number of lines written.
+    """
+    trimmed = iter_trimmed(infile, policy, workers)
+    with open(outfile, 'wb') as fh:
+        if unique == 'sort':
+            return sort_unique(trimmed, fh)
+        if unique == 'hash':
+            trimmed = hash_unique(trimmed)
+        count = 0
+        for kept in trimmed:
+            fh.write(kept)
+            count += kept.count(b'\n')
+    return count
+
+
+def main():
+    policy = (args.min_length, args.max_length, tuple(dict.fromkeys(args.require)), args.first_char, args.charset)
+    if args.verbose:
+        print('[*] Policy pattern: {}'.format(policy_regex(*policy)))
+    count = trim_file(infile, outfile, policy, args.workers, args.unique)
+    print('Password list trimming complete! Trimmed to {} words.'.format(count))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument("filename", help="the password list to trim")
+    parser.add_argument("-o", "--outfile", help="file to write the trimmed list to (default=trimmed_[filename])")
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    parser.add_argument("-p", "--preset", choices=sorted(PRESETS), default='legacy',
+                        help="named policy to start from (default=legacy, 8 characters of letters, digits and underscore starting with a letter and holding an upper and lower case letter and a digit)")
+    parser.add_argument("-min", "--min_length", type=int, help="shortest password to keep")
+    parser.add_argument("-max", "--max_length", type=int, help="longest password to keep, 0 for no limit")
+    parser.add_argument("-r", "--require", nargs='*', choices=sorted(CHARACTER_CLASSES),
+                        help="character classes every password must contain")
+    parser.add_argument("-fc", "--first_char", choices=sorted(FIRST_CHARACTERS),
+                        help="class of the first character")
+    parser.add_argument("-cs", "--charset", choices=sorted(CHARSETS),
+                        help="characters a password may contain: letters, digits and underscore (word), letters and digits (alnum), printable ASCII (printable), digits (digits) or anything but whitespace (any)")
+    parser.add_argument("-u", "--unique", nargs='?', const='hash', choices=['hash', 'sort'],
+                        help="drop duplicate passwords, keeping the order with a compact hash set (hash, the default) or sorting through temporary files for lists larger than memory (sort)")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of processes to trim with (default=1)")
+    args = parser.parse_args()
+
+    for option, value in PRESETS[args.preset].items():
+        if getattr(args, option) is None:
+            setattr(args, option, value)
+
+    infile = args.filename
+    outfile = args.outfile or 'trimmed_' + os.path.basename(infile)
+
+    if not Path(infile).is_file():
+        print('The file {} could not be found. Please try again'.format(infile))
+        exit()
+
+    if args.max_length and args.max_length < args.min_length:
+        print('The maximum length cannot be less than the minimum length. Please try again')
+        exit()
 
-with open(outfile, 'w') as file:
-    for word in trimmed_list:
-        file.write(word)
-        
-print('Password list trimming complete! Trimmed to {} words.'.format(len(trimmed_list)))
\ No newline at end of file
+    main()
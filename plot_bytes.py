@@ -7,11 +7,12 @@ __description__ = """A program to plot byte values for a given set of data"""
 
 
 import matplotlib.pyplot as plt 
+import numpy as np
 import base64
 import urllib.parse
 import argparse
 import os
-import time
+from byte_stats import as_byte_array, byte_stats, density_image, file_histogram, map_file, minmax_decimate, stats_from_histogram
 
 
 def decode_url_encoding(input_string):
@@ -24,55 +25,76 @@ def decode_url_encoding(input_string):
     return urllib.parse.unquote(input_string).encode()
 
 
-def get_integer_list(input_bytes):
-    """Returns a list of byte integers from a byte-string.
+def finish_plot(kind):
+    """Shows the current plot, or saves it to the --save file when given.
+    When both plots are saved the kind of plot is added to the file name.
     """
-    return [byte for byte in input_bytes]
-
-
-def create_byte_histogram(input_bytes):
-    """Returns a dictionary containing each byte value as a key and the
-    number of times it occures in the input bytes as a value.
-    """
-    bytes_dict = dict()
-    for byte in input_bytes:
-        bytes_dict[byte] = bytes_dict.get(byte, 0) + 1
-    return bytes_dict
-
-    
-def check_byte_representation(bytes_dict):
-    """Generates a list of all possible 256 bytes values and returns any
-    byte value that does not appear as a key in the supplied dictionary.
+    if not args.save:
+        plt.show()
+        return
+    filename = args.save
+    if args.plot_histogram and args.plot_scatter:
+        root, ext = os.path.splitext(args.save)
+        filename = '{}_{}{}'.format(root, kind, ext or '.png')
+    plt.savefig(filename)
+    plt.close()
+    print("[*] Saved the {} plot to {}".format(kind, filename))
+
+
+def plot_histogram(histogram):
+    """Plots a histogram from the given array of 256 byte counts.
     """
-    missing_byte_list = []
-    total_bytes = [byte for byte in range(256)]
-    for byte in total_bytes:
-        if byte not in bytes_dict:
-            missing_byte_list.append(byte)
-    return missing_byte_list
-        
-
-def plot_histogram(data):
-    """Plots a histogram from the given data.
-    """
-    plt.hist(data, color='g')
+    plt.figure()
+    plt.bar(range(256), histogram, color='g')
     plt.title('Byte Histogram')
     plt.ylabel('Occurence')
     plt.xlabel('Byte Values')
     plt.xticks(range(0, 256, 10))
-    plt.show()
+    finish_plot('histogram')
 
 
 def plot_scatter(data):
-    """Plots a scatter chart from the given data.
+    """Plots byte values against their offset. Rather than one point per
+    byte, the offsets are grouped into --columns buckets and drawn either
+    as an image of how often each byte value occurs in each bucket, or as
+    the band between the lowest and highest value of each bucket. Either
+    way the plot costs the same for any size of data.
     """
-    positions = [i for i in range(len(data))]
-    plt.scatter(data_list, positions, edgecolors='r')
+    plt.figure()
+    if args.plot_mode == 'minmax':
+        lows, highs, width = minmax_decimate(data, args.columns)
+        offsets = np.arange(len(lows)) * width
+        plt.fill_betweenx(offsets, lows, highs, color='r', step='post')
+    else:
+        image, width = density_image(data, args.columns)
+        plt.imshow(np.log1p(image), aspect='auto', origin='lower', interpolation='nearest',
+                   extent=[0, 256, 0, len(image) * width])
     plt.title('Byte Scatter Plot')
-    plt.ylabel('Occurence')
+    plt.ylabel('Offset')
     plt.xlabel('Byte Values')
     plt.xticks(range(0, 256, 10))
-    plt.show()
+    finish_plot('scatter')
+
+
+def print_stats(stats):
+    """Prints the byte representation, entropy and chi-square results.
+    """
+    print("[+] {} bytes positions are not represented in the data".format(len(stats['missing'])))
+    print("[+] Entropy: {:.4f} bits per byte, chi-square: {:.2f}".format(stats['entropy'], stats['chi_square']))
+
+
+def process_file(filename):
+    """Counts the file in chunks read into a reused buffer across the
+    requested number of worker processes, without reading it into
+    memory. Only the scatter plot maps the file.
+    """
+    print("[*] Processing {}...".format(filename))
+    stats = stats_from_histogram(file_histogram(filename, args.workers))
+    if args.plot_histogram:
+        plot_histogram(stats['histogram'])
+    if args.plot_scatter:
+        plot_scatter(map_file(filename))
+    print_stats(stats)
 
 
 def main():
@@ -83,20 +105,14 @@ def main():
         data = decode_url_encoding(data)
     if args.b64_decode:
         data = base64.b64decode(data)
-    data_list = get_integer_list(data)
-    integer_list = [i for i in range(256)]
+    stats = byte_stats(data)
     if args.plot_histogram:
-        plot_histogram(data_list)
+        plot_histogram(stats['histogram'])
     if args.plot_scatter:
-        plot_scatter(data_list)
+        plot_scatter(as_byte_array(data))
     print("[*] Processing {}...".format(data[:50]))
-    time.sleep(1)
-    data_dict = create_byte_histogram(data)
     print("[*] Checking if all bytes are represented")
-    time.sleep(1)
-    missing_bytes = check_byte_representation(data_dict)
-    missing_byte_count = sum([1 for byte in missing_bytes])
-    print("[+] {} bytes positions are not represented in the data".format(missing_byte_count))
+    print_stats(stats)
 
 
 if __name__ == '__main__':
@@ -120,8 +136,25 @@ if __name__ == '__main__':
     parser.add_argument("-b", "--b64_decode",
                         help="Decode the b64 encoded data", 
                         action="store_true")
+    parser.add_argument("-w", "--workers",
+                        help="Number of processes used to count a file (default=1)",
+                        type=int,
+                        default=1)
+    parser.add_argument("-pm", "--plot_mode",
+                        help="Draw the scatter plot as a density image or as min/max bands (default=density)",
+                        choices=['density', 'minmax'],
+                        default='density')
+    parser.add_argument("-c", "--columns",
+                        help="Number of offset buckets the scatter plot is reduced to (default=1024)",
+                        type=int,
+                        default=1024)
+    parser.add_argument("-s", "--save",
+                        help="Save the plots to this PNG file instead of showing them, without needing a display")
     args = parser.parse_args()
 
+    if args.save:
+        plt.switch_backend('Agg')
+
     if not args.data and not args.file:
         parser.print_help()
         print('\n[-] Please specify the encrypted data (-d data) or specify a file containing the data (-f /path/to/data) ')
@@ -136,7 +169,10 @@ if __name__ == '__main__':
         if not os.path.exists(args.file):
             print("\n[-] The file cannot be found or you do not have permission to open the file. Please check the path and try again\n")
             exit()
-        else:
+        elif args.url_decode or args.b64_decode:
             with open(args.file, 'rb') as fh:
                 input_data = fh.read()
+        else:
+            process_file(args.file)
+            exit()
     main()
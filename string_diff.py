@@ -1,47 +1,210 @@
 #!/usr/bin/env python
 
-# Description: Compares two strings and outputs the 
-# differences character by character.
+# Description: Compares two strings and outputs the
+# differences character by character. Can also compare
+# two files byte by byte, many pairs of tokens at once,
+# or report which character positions vary across a
+# list of tokens, such as session IDs, to judge how
+# random they are.
 
 # Author: Jake Miller (@LaconicWolf)
-# Adapted from: 
+# Adapted from:
 # https://stackoverflow.com/questions/12226846/count-letter-differences-of-two-strings
 
-import sys
+import argparse
 
 try:
     from itertools import zip_longest
 except ImportError:
     from itertools import izip_longest as zip_longest
 
-usage = "Usage: ./string_diff.py <string1> <string2>"
+import numpy as np
 
-if len(sys.argv) != 3:
-    print(usage)
-    exit()
 
-string1 = sys.argv[1]
-string2 = sys.argv[2]
+def as_bytes(token):
+    """Returns a token as bytes, encoding strings as UTF-8.
+    """
+    return token if isinstance(token, bytes) else token.encode('utf-8')
 
-try:
-    both = zip_longest(string1, string2)
-except Exception as e:
-    print('[-] An error occurred: \n'.format(e))
-    exit()
-
-print('Pos   S1  S2\n')
-
-char_num = 0
-for i, j in both:
-    char_num += 1
-    char_pos = str(char_num)
-    while len(char_pos) < 6:
-        char_pos += ' '
-    if i == j:
-        print('{}{} = {}'.format(char_pos, i, j))
+
+def token_array(tokens, width=None):
+    """Lays a list of tokens out as a 2-D uint8 array with one row per
+    token, padded with zeros to width (by default the longest token).
+    Returns the array and the length of each token. Tokens of equal
+    length are joined and reshaped without padding.
+    """
+    tokens = [as_bytes(token) for token in tokens]
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    longest = int(lengths.max()) if len(tokens) else 0
+    width = max(width or longest, longest, 1)
+    if len(tokens) and longest == width and (lengths == width).all():
+        return np.frombuffer(b''.join(tokens), dtype=np.uint8).reshape(len(tokens), width), lengths
+    array = np.zeros((len(tokens), width), dtype=np.uint8)
+    array[np.arange(width) < lengths[:, None]] = np.frombuffer(b''.join(tokens), dtype=np.uint8)
+    return array, lengths
+
+
+def diff_masks(first, second):
+    """Compares two lists of tokens pair by pair and returns a boolean
+    array with one row per pair, True at each position where the tokens
+    differ. A position past the end of only one of the tokens counts as
+    a difference.
+    """
+    width = max([len(as_bytes(token)) for token in list(first) + list(second)] or [1])
+    first, first_lengths = token_array(first, width)
+    second, second_lengths = token_array(second, width)
+    positions = np.arange(width)
+    return (first != second) | ((positions < first_lengths[:, None]) != (positions < second_lengths[:, None]))
+
+
+def hamming_distances(first, second):
+    """Returns the Hamming distance between each pair of tokens of two
+    lists, counting length differences as differing positions.
+    """
+    return diff_masks(first, second).sum(axis=1)
+
+
+def diff_ranges(mask):
+    """Joins the consecutive True positions of a 1-D mask into ranges.
+    Returns a list of (start, end) offsets.
+    """
+    edges = np.flatnonzero(np.diff(np.r_[0, mask.astype(np.int8), 0]))
+    return [(int(start), int(end)) for start, end in zip(edges[::2], edges[1::2])]
+
+
+def position_variability(tokens):
+    """Counts the characters seen at each position across a list of
+    tokens in one pass with NumPy. Returns a dictionary of arrays indexed
+    by position: the number of tokens long enough to reach it, the number
+    of distinct characters seen there, the Shannon entropy of those
+    characters in bits, and whether the position ever changes.
+    """
+    array, lengths = token_array(tokens)
+    width = array.shape[1]
+    present = np.arange(width) < lengths[:, None]
+    keys = (np.nonzero(present)[1] * 256 + array[present]).astype(np.int64)
+    histograms = np.bincount(keys, minlength=width * 256).reshape(width, 256)
+    counts = histograms.sum(axis=1)
+    sizes = np.maximum(counts, 1)
+    weighted = (histograms * np.log2(np.maximum(histograms, 1))).sum(axis=1)
+    distinct = np.count_nonzero(histograms, axis=1)
+    return {
+        'tokens': counts,
+        'distinct': distinct,
+        'entropy': np.maximum(np.log2(sizes) - weighted / sizes, 0),
+        'changes': distinct > 1,
+    }
+
+
+def char_diff(string1, string2):
+    """Yields the position, counted from 1, and the characters of two
+    strings side by side, with None past the end of the shorter one.
+    """
+    for position, (i, j) in enumerate(zip_longest(string1, string2), 1):
+        yield position, i, j
+
+
+def read_lines(filename):
+    """Returns the lines of a file as bytes without their line endings,
+    skipping blank lines.
+    """
+    with open(filename, 'rb') as fh:
+        return [line.rstrip(b'\r') for line in fh.read().split(b'\n') if line.strip()]
+
+
+def print_char_diff(string1, string2):
+    print('Pos   S1  S2\n')
+    for position, i, j in char_diff(string1, string2):
+        if i == j:
+            print('{}{} = {}'.format(str(position).ljust(6), i, j))
+        else:
+            print('{}{}   {}'.format(str(position).ljust(6), i or ' ', j or ' '))
+
+
+def print_file_diff(filename1, filename2):
+    with open(filename1, 'rb') as fh:
+        data1 = fh.read()
+    with open(filename2, 'rb') as fh:
+        data2 = fh.read()
+    mask = diff_masks([data1], [data2])[0]
+    ranges = diff_ranges(mask)
+    print('[*] {} is {} bytes and {} is {} bytes'.format(filename1, len(data1), filename2, len(data2)))
+    if not ranges:
+        print('[+] The files are identical')
+        return
+    print('[+] {} bytes differ in {} ranges\n'.format(int(mask.sum()), len(ranges)))
+    print('Offset      Length')
+    for start, end in ranges[:args.max_ranges]:
+        print('{}{}'.format(str(start).ljust(12), end - start))
+    if len(ranges) > args.max_ranges:
+        print('[*] {} more ranges not shown'.format(len(ranges) - args.max_ranges))
+
+
+def print_pair_diffs(filename):
+    pairs = [line.split(args.delimiter, 1) for line in read_lines(filename)]
+    pairs = [pair for pair in pairs if len(pair) == 2]
+    if not pairs:
+        print('[-] No token pairs found in {}'.format(filename))
+        return
+    first, second = zip(*pairs)
+    masks = diff_masks(first, second)
+    distances = masks.sum(axis=1)
+    marks = np.where(masks, ord('^'), ord('.')).astype(np.uint8)
+    widths = np.maximum([len(token) for token in first], [len(token) for token in second])
+    print('Pair  Distance  Differences')
+    for number, (distance, row, width) in enumerate(zip(distances.tolist(), marks, widths.tolist()), 1):
+        print('{}{}{}'.format(str(number).ljust(6), str(distance).ljust(10), row[:width].tobytes().decode()))
+    print('\n[*] Compared {} pairs: {} identical, mean Hamming distance {:.2f}'.format(
+        len(pairs), int((distances == 0).sum()), float(distances.mean())))
+
+
+def print_variability(filename):
+    tokens = read_lines(filename)
+    if not tokens:
+        print('[-] No tokens found in {}'.format(filename))
+        return
+    stats = position_variability(tokens)
+    print('Pos   Tokens    Distinct  Entropy')
+    for position in range(len(stats['tokens'])):
+        print('{}{}{}{:.2f}{}'.format(
+            str(position + 1).ljust(6), str(stats['tokens'][position]).ljust(10), str(stats['distinct'][position]).ljust(10),
+            stats['entropy'][position], '' if stats['changes'][position] else '  (never changes)'))
+    fixed = np.flatnonzero(~stats['changes']) + 1
+    print('\n[*] Analyzed {} tokens of up to {} characters'.format(len(tokens), len(stats['tokens'])))
+    print('[*] {} positions never change{}'.format(len(fixed), ': ' + ', '.join(map(str, fixed.tolist())) if len(fixed) else ''))
+    print('[*] Total entropy across positions: {:.2f} bits'.format(float(stats['entropy'].sum())))
+
+
+def main():
+    if args.pairs:
+        print_pair_diffs(args.pairs)
+    elif args.tokens:
+        print_variability(args.tokens)
+    elif args.files:
+        print_file_diff(*args.strings)
     else:
-        if not i:
-            i = ' '
-        if not j:
-            j = ' '
-        print('{}{}   {}'.format(char_pos, i, j))
+        print_char_diff(*args.strings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="./string_diff.py <string1> <string2>")
+    parser.add_argument("strings", nargs='*', help="two strings to compare character by character, or two files with -f")
+    parser.add_argument("-f", "--files", help="compare the contents of two files byte by byte and report the ranges that differ", action="store_true")
+    parser.add_argument("-p", "--pairs", help="file of token pairs, one pair per line, to compare in a batch")
+    parser.add_argument("-d", "--delimiter", default=None, help="separator between the tokens of a pair with -p (default=whitespace)")
+    parser.add_argument("-t", "--tokens", help="file of tokens, one per line, to report the variability of each character position for")
+    parser.add_argument("-mr", "--max_ranges", type=int, default=100, help="most differing ranges printed with -f (default=100)")
+    args = parser.parse_args()
+
+    if args.delimiter is not None:
+        args.delimiter = args.delimiter.encode('utf-8')
+
+    if not (args.pairs or args.tokens) and len(args.strings) != 2:
+        parser.print_usage()
+        exit()
+
+    try:
+        main()
+    except OSError as e:
+        print('[-] An error occurred: {}'.format(e))
+        exit()
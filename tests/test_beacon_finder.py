@@ -0,0 +1,44 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import beacon_finder
+
+
+HEADER = 'ts,id.orig_h,id.orig_p,id.resp_h,id.resp_p,proto,service,duration,orig_bytes,resp_bytes,conn_state,missed_bytes\n'
+
+
+def write_hourly_logs(directory, hours):
+    start = 1526282123
+    for hour in range(hours):
+        with open(os.path.join(directory, 'conn.{:02d}.log'.format(hour)), 'w') as fh:
+            fh.write(HEADER)
+            for minute in range(60):
+                ts = start + hour * 3600 + minute * 60
+                fh.write('{}.000000,10.0.0.1,40000,10.0.0.2,443,tcp,ssl,1.0,100,200,SF,0\n'.format(ts))
+    with open(os.path.join(directory, 'conn.empty.log'), 'w') as fh:
+        fh.write(HEADER)
+
+
+def test_rolling_window_does_not_parse_retired_logs_again(tmp_path, capsys):
+    logs = tmp_path / 'logs'
+    logs.mkdir()
+    write_hourly_logs(str(logs), 24)
+    filenames = beacon_finder.find_logs(str(logs))
+    state = str(tmp_path / 'state')
+
+    ips, columns = beacon_finder.fold_logs(filenames, state, 1, window_hours=5)
+    assert 'Parsing 25 new logs' in capsys.readouterr().out
+    rows = len(columns['ts'])
+
+    ips, columns = beacon_finder.fold_logs(filenames, state, 1, window_hours=5)
+    assert 'Parsing' not in capsys.readouterr().out
+    assert len(columns['ts']) == rows
+
+
+def test_directory_only_finds_conn_logs(tmp_path):
+    write_hourly_logs(str(tmp_path), 2)
+    (tmp_path / 'dns.log').write_text('1526282123.000000,10.0.0.1,53\n')
+    names = [os.path.basename(filename) for filename in beacon_finder.find_logs(str(tmp_path))]
+    assert names == ['conn.00.log', 'conn.01.log', 'conn.empty.log']
@@ -0,0 +1,27 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_random_csv
+
+
+def load_columns(tmp_path, columns):
+    schema = tmp_path / 'schema.json'
+    schema.write_text(json.dumps(columns))
+    return generate_random_csv.load_schema(str(schema))
+
+
+def test_normal_int_column_centres_on_its_mean(tmp_path):
+    column, = load_columns(tmp_path, [{'name': 'n', 'type': 'int', 'distribution': 'normal', 'mean': 500, 'std': 10}])
+    values = generate_random_csv.generate_column(column, (1,), 0, 0, 100000)
+    assert abs(values.mean() - 500) < 1
+    assert 9 < values.std() < 11
+
+
+def test_non_ascii_alphabet_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        load_columns(tmp_path, [{'name': 's', 'type': 'string', 'alphabet': 'äb'}])